@@ -8,39 +8,82 @@ from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
+from app.utils.mail_queue import MailQueue
+from app.utils.credentials import CredentialService
+from app.utils.json_provider import ORJSONProvider, orjson
+from app.utils.compression import compressor
 # Load environment variables
 load_dotenv()
 
 # Initialize extensions
 db = SQLAlchemy()
 mail = Mail()
+mail_queue = MailQueue(mail)
+credentials = CredentialService()
 def create_app():
     app = Flask(__name__)
+    # Faster encoding for every jsonify() response when orjson is installed
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOADS_FOLDER'] = os.getenv('UPLOADS_FOLDER')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit to 16MB
+    # Bulk imports (POST /api/products/import) may be larger than any other request
+    app.config['IMPORT_MAX_CONTENT_LENGTH'] = int(os.getenv('IMPORT_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
     app.config['WTF_CSRF_TIME_LIMIT'] = 3600
+    # How uploads are served: 'direct' streams them from this process,
+    # 'x-sendfile' and 'x-accel' hand the file off to the fronting proxy
+    app.config['IMAGE_SERVING'] = os.getenv('IMAGE_SERVING', 'direct')
+    app.config['IMAGE_X_ACCEL_PREFIX'] = os.getenv('IMAGE_X_ACCEL_PREFIX', '/protected-uploads/')
+    app.config['USE_X_SENDFILE'] = app.config['IMAGE_SERVING'] == 'x-sendfile'
+    # Password hashing cost and how many hashes may run at once per process
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
     app.config.update(
         SESSION_COOKIE_SAMESITE='None',
         SESSION_COOKIE_SECURE=True
     )
 
     # mailing service configuration
-    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-    app.config['MAIL_PORT'] = 465
-    app.config['MAIL_USE_SSL'] = True
-    app.config['MAIL_USE_TLS'] = False
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 465))
+    app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL', 'true').lower() == 'true'
+    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'false').lower() == 'true'
     app.config['MAIL_USERNAME'] = os.getenv("MAIL_SENDER")
     app.config['MAIL_DEFAULT_SENDER'] = os.getenv("MAIL_DEFAULT_SENDER")
     app.config['MAIL_PASSWORD'] = os.getenv("MAIL_PASSWORD")
+    # Background senders per process, 0 sends on the request thread
+    app.config['MAIL_QUEUE_WORKERS'] = int(os.getenv('MAIL_QUEUE_WORKERS', 2))
+    # Request/SQL metrics at /api/admin/metrics and Server-Timing headers
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_SLOW_QUERY_MS'] = float(os.getenv('METRICS_SLOW_QUERY_MS', 100))
+    app.config['METRICS_SERVER_TIMING'] = os.getenv('METRICS_SERVER_TIMING', 'true').lower() == 'true'
+    # Folder shared by all gunicorn workers, so a scrape sees every worker's totals
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    # Lets a scraper read the metrics with "Authorization: Bearer <token>" instead of an admin session
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    # gzip/brotli for JSON, NDJSON and CSV responses of at least COMPRESSION_MIN_SIZE bytes
+    app.config['COMPRESSION_ENABLED'] = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv('COMPRESSION_MIN_SIZE', 500))
+    app.config['COMPRESSION_LEVEL'] = int(os.getenv('COMPRESSION_LEVEL', 6))
+    app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+    app.config['COMPRESSION_CACHE_SIZE'] = int(os.getenv('COMPRESSION_CACHE_SIZE', 256))
 
     # Initialize extensions
     db.init_app(app)
-    Migrate(app, db)
+    from .utils.search import include_object
+    Migrate(app, db, include_object=include_object)
     # csrf = CSRFProtect(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
+    credentials.init_app(app)
+    # Registered before compression, so its after_request hook runs last and sees the sent size
+    from app.utils.metrics import metrics
+    metrics.init_app(app)
+    compressor.init_app(app)
 
     # Restrict access to frontend
     CORS(app, origins=[os.getenv('ALLOWED_ORIGIN')], supports_credentials=True)
@@ -51,13 +94,13 @@ def create_app():
 
     app.config['REMEMBER_COOKIE_DURATION'] = timedelta(weeks=1)
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(weeks=1)
-    # Import the User model here
-    from app.models import User
+    # Import the identity cache here, it needs the User model
+    from app.utils.identity_cache import identity_cache
     
-    # User loader for Flask-Login
+    # User loader for Flask-Login, served from the identity cache
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity_cache.load(int(user_id))
     
     login_manager.login_view = None  # Disable redirect
 
@@ -67,5 +110,9 @@ def create_app():
         app.register_blueprint(blueprint, url_prefix='/api')
     from .auth import auth
     app.register_blueprint(auth, url_prefix='/auth')
-    print(f"DATABASE_URI: {os.getenv('SQLALCHEMY_DATABASE_URI')}")
+
+    # Register CLI commands
+    from .commands import commands
+    for command in commands:
+        app.cli.add_command(command)
     return app
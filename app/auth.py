@@ -2,16 +2,21 @@ from flask import Blueprint, request, jsonify, make_response, session
 from flask_login import current_user, login_user, login_required, logout_user
 from flask_cors import cross_origin
 from flask_mail import Message
-from app import mail;
-from werkzeug.security import generate_password_hash, check_password_hash
+from app import mail_queue, credentials
 from app import db
-from app.models import User
+from app.models import User, Product, get_current_timestamp
+from app.serializers import user_serializer, USER_ACCOUNT_FIELDS, USER_IDENTITY_FIELDS
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import BadRequest
 from flask_wtf.csrf import generate_csrf
 import random
 import time
+import hmac
 from app.utils.validate_request_csrf import validate_request_csrf
+from app.utils.code_store import make_code_store
+from app.utils.identity_cache import identity_cache
+from app.utils.cache import catalog_cache
+from app.utils.stats import record, user_deltas
 import os
 
 auth = Blueprint('auth', __name__)
@@ -25,39 +30,42 @@ def is_seller():
 def is_buyer():
     return current_user.role == 'buyer'
 
-confirmation_codes = {}
+# Where pending confirmation codes live. The default database store is
+# shared by all gunicorn workers; see make_code_store for the alternatives.
+confirmation_codes = make_code_store(os.getenv('CONFIRMATION_CODE_STORE', 'database'))
+CONFIRMATION_CODE_TTL = 300
 
 def store_confirmation_code(code, email):
-    confirmation_codes[email] = {'confirmation_code': str(code), 'confirmation_code_expiry': time.time() + 300}
+    confirmation_codes.set(email, str(code), time.time() + CONFIRMATION_CODE_TTL)
 
 def verify_confirmation_code(email, code):
     # Check if email and code are provided
     if not email or not code:
         return False, "Email and confirmation code are required."
 
-    # Check if the email exists in the confirmation_codes
-    if email not in confirmation_codes:
+    # Get the stored confirmation code and expiry
+    stored_data = confirmation_codes.get(email)
+
+    # Check if the email has a confirmation code
+    if stored_data is None:
         return False, "Confirmation code not found for this email."
 
-    # Get the stored confirmation code and expiry
-    stored_data = confirmation_codes[email]
+    stored_code, expires_at = stored_data
 
     # Check if the code has expired
-    if time.time() > stored_data.get("confirmation_code_expiry", 0):
+    if time.time() > expires_at:
         delete_confirmation_code(email)
         return False, "Confirmation code has expired."
 
     # Check if the code matches
-    stored_code = stored_data.get('confirmation_code')
-    if code == stored_code:
+    if hmac.compare_digest(str(code).encode(), str(stored_code).encode()):
         # delete_confirmation_code(email)  # Optionally delete after success
         return True, None  # Successfully verified
     else:
         return False, "Invalid confirmation code."
     
 def delete_confirmation_code(email):
-    if email in confirmation_codes:
-        del confirmation_codes[email]
+    confirmation_codes.delete(email)
 
 
 # ROUTES FOR ALL USERS
@@ -127,7 +135,7 @@ def register():
             return jsonify({'message': 'Username already exists'}), 400
 
         # Create new user
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+        hashed_password = credentials.hash(password)
         new_user = User(
             email=email,
             username=username,
@@ -139,19 +147,13 @@ def register():
         )
 
         db.session.add(new_user)
+        record(user_deltas(role))
         db.session.commit()
         login_user(new_user, remember=True)
 
         return jsonify({
             'message': 'Account created successfully!',
-            'user': {
-                'email': email,
-                'username': username,
-                'role': role,
-                'full_name': full_name,
-                "address": address,
-                "card_number": card_number
-            }
+            'user': user_serializer.dump(new_user, USER_ACCOUNT_FIELDS)
         }), 201
 
     except Exception as e:
@@ -176,21 +178,18 @@ def login():
             user = User.query.filter_by(username=username).first()
         if not user:
             return jsonify({'message': "Invalid credentials"}), 401
-        if not user.email or not check_password_hash(user.password, password):
+        if not user.email or not credentials.verify(user.password, password):
             return jsonify({'message': 'Invalid credentials'}), 401
+
+        # Upgrade hashes made with outdated parameters while we have the password
+        if credentials.needs_rehash(user.password):
+            user.password = credentials.hash(password)
+            db.session.commit()
         
         login_user(user, remember=True)
         return jsonify({
             'message': 'Login successful!',
-            'user': {
-                'id': user.id,
-                'email': user.email,
-                'username': user.username,
-                'role': user.role,
-                'full_name': user.full_name,
-                'address': user.address,
-                'card_number': user.card_number
-            }
+            'user': user_serializer.dump(user, USER_ACCOUNT_FIELDS)
         }), 200
 
 @auth.route('/confirmation-code', methods=['POST'])
@@ -222,7 +221,8 @@ def send_confirmation_code():
                   recipients=[email],
                   body=body)
     try:
-        mail.send(msg)
+        # Delivered by the background mail queue, don't wait for SMTP here
+        mail_queue.send(msg)
         return jsonify({"message": "Email sent successfully!"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -235,6 +235,8 @@ def reset_password():
     email = data.get("email")
     confirmation_code = data.get("confirmation_code")
     new_password = data.get("new_password")
+    if not new_password:
+        return jsonify({"message": "new_password is required"}), 400
     confirmed, message = verify_confirmation_code(email, confirmation_code)
     
     if not confirmed:
@@ -244,8 +246,9 @@ def reset_password():
     if not user:
         return jsonify({"message": "You are not registered"})
 
-    user.password = generate_password_hash(new_password, method='pbkdf2:sha256')
+    user.password = credentials.hash(new_password)
     db.session.commit()
+    identity_cache.invalidate(user.id)
     return jsonify({"message": "Password reset successfully"})
 # ROUTES FOR REGISTERED USERS
 
@@ -256,17 +259,15 @@ def me():
     try:
         validate_request_csrf()
         if request.method == "GET":
-            return jsonify({
-                'user': {
-                    'id': current_user.id,
-                    'email': current_user.email,
-                    'username': current_user.username,
-                    'role': current_user.role,
-                    'full_name': current_user.full_name if current_user.role in ['buyer', 'seller'] else None,
-                    'address': current_user.address if current_user.role in ['buyer', 'seller'] else None,
-                    'card_number': current_user.card_number if current_user.role in ['buyer', 'seller'] else None
+            if current_user.role in ['buyer', 'seller']:
+                user = user_serializer.dump(current_user, USER_ACCOUNT_FIELDS)
+            else:
+                # Admins have no profile; the cached identity answers without loading the row
+                user = {
+                    **dict.fromkeys(USER_ACCOUNT_FIELDS),
+                    **user_serializer.dump(current_user, USER_IDENTITY_FIELDS)
                 }
-            }), 200
+            return jsonify({'user': user}), 200
         elif request.method == "PUT":
             data = request.get_json()
 
@@ -283,7 +284,8 @@ def me():
                     return jsonify({'message': message}), 400
                 
             username = data.get('username') or current_user.username
-            password = data.get('password') or current_user.password
+            # Only a newly supplied password needs hashing
+            password = data.get('password')
             role = data.get('role') or current_user.role
             if role not in ['buyer', 'seller']:
                 return jsonify({'message': 'Invalid role'}), 400
@@ -296,9 +298,18 @@ def me():
             if not user:
                 return jsonify({'message': 'User not found'}), 404
             
+            if role != user.role:
+                record(user_deltas(user.role, sign=-1), user_deltas(role))
+            # Product pages show the seller's name, so their validators must change with it
+            renamed = username != user.username
+            if renamed:
+                Product.query.filter_by(user_id=user.id).update(
+                    {Product.updated_at: get_current_timestamp()}, synchronize_session=False
+                )
             user.email = new_email or old_email
             user.username = username
-            user.password = generate_password_hash(password, method='pbkdf2:sha256')
+            if password:
+                user.password = credentials.hash(password)
             user.role = role
             user.address = address
             user.full_name = full_name
@@ -306,6 +317,9 @@ def me():
             user.support_email = support_email
 
             db.session.commit()
+            identity_cache.invalidate(user.id)
+            if renamed:
+                catalog_cache.bump()
 
             return jsonify({
                 'message': 'User updated to successfully!',
@@ -346,7 +360,9 @@ def delete_account():
     
     user = User.query.get_or_404(current_user.id)
     db.session.delete(user)
+    record(user_deltas(user.role, sign=-1))
     db.session.commit()
+    identity_cache.invalidate(user.id)
     logout_user()
     return jsonify({"message": "Account deleted successfully"})
     
\ No newline at end of file
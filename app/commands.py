@@ -0,0 +1,96 @@
+import os
+import click
+from flask.cli import with_appcontext
+from . import db
+from .models import Product, Review
+from .utils.search import install_search_index
+from .utils.image_pipeline import image_pipeline
+from .utils.upload_gc import UploadCollector
+from .utils import stats
+
+def review_aggregate(expression, *conditions):
+    return db.select(expression).where(Review.product_id == Product.id, *conditions).scalar_subquery()
+
+@click.command('backfill-ratings')
+@with_appcontext
+def backfill_ratings():
+    """Recompute every product's rating aggregates from the reviews table."""
+    # A single UPDATE with correlated subqueries, so review writes running
+    # at the same time either land before it or are applied on top of it
+    values = {
+        Product.rating_sum: review_aggregate(db.func.coalesce(db.func.sum(Review.rating), 0)),
+        Product.rating_count: review_aggregate(db.func.count(Review.id)),
+        Product.overall_rating: review_aggregate(db.func.coalesce(db.func.avg(Review.rating), 0.0)),
+    }
+    for stars in range(1, 6):
+        values[getattr(Product, f'rating_count_{stars}')] = review_aggregate(
+            db.func.count(Review.id), Review.rating == stars
+        )
+    updated = Product.query.update(values, synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Recomputed rating aggregates for {updated} products')
+
+@click.command('install-search-index')
+@with_appcontext
+def install_search_index_command():
+    """Create the full-text search column/table for the configured database."""
+    with db.engine.begin() as connection:
+        installed = install_search_index(connection)
+    if installed:
+        click.echo(f'Search index installed for {db.engine.dialect.name}')
+    else:
+        click.echo(f'No search index support for {db.engine.dialect.name}, using substring matching')
+
+@click.command('backfill-image-variants')
+@click.option('--force', is_flag=True, help='Regenerate variants that already exist.')
+@with_appcontext
+def backfill_image_variants(force):
+    """Generate resized variants for images uploaded before the pipeline existed."""
+    if not image_pipeline.enabled:
+        raise click.ClickException('Image variants need Pillow and IMAGE_PIPELINE_WORKERS > 0')
+
+    paths = set()
+    for (images,) in db.session.query(Product.images).execution_options(yield_per=1000):
+        paths.update(images or [])
+    pending = sorted(path for path in paths if force or not image_pipeline.has_variants(path))
+
+    generated = failed = 0
+    for path, result in image_pipeline.map(pending):
+        if isinstance(result, Exception):
+            failed += 1
+            click.echo(f'Failed {path}: {result}', err=True)
+        else:
+            generated += 1
+    click.echo(f'Generated variants for {generated} images, {failed} failed, {len(paths) - len(pending)} up to date')
+
+@click.command('gc-uploads')
+@click.option('--grace-period', default=86400, show_default=True, help='Keep files modified within this many seconds.')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--limit', type=int, default=None, help='Stop after deleting this many files.')
+@click.option('--dry-run', is_flag=True, help='Report what would be deleted without deleting it.')
+@with_appcontext
+def gc_uploads(grace_period, batch_size, limit, dry_run):
+    """Delete uploaded files and variants that no product references."""
+    collector = UploadCollector(
+        os.getenv('UPLOADS_FOLDER'),
+        grace_period=grace_period,
+        batch_size=batch_size,
+        limit=limit,
+        dry_run=dry_run
+    )
+    result = collector.run(on_delete=click.echo if dry_run else None)
+    action = 'Would delete' if dry_run else 'Deleted'
+    click.echo(
+        f"{action} {result['deleted']} files ({result['bytes'] / 1024 / 1024:.1f} MiB); "
+        f"scanned {result['scanned']}, {result['referenced']} referenced, {result['recent']} within the grace period"
+    )
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats():
+    """Recompute the admin dashboard counters from the users, products and reviews tables."""
+    counters = stats.rebuild()
+    click.echo(f'Rebuilt {counters} statistics counters')
+
+# List all commands to register
+commands = [backfill_ratings, install_search_index_command, backfill_image_variants, gc_uploads, rebuild_stats]
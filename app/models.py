@@ -1,10 +1,36 @@
 from . import db
+from sqlalchemy.dialects import postgresql, sqlite
 import time
 
 def get_current_timestamp():
     return int(time.time() * 1000)
 
+def increment_counter(key_column, key, value_column, amount):
+    """Atomically add `amount` to a counter row in the session's transaction, creating it if missing"""
+    model = key_column.class_
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert(model)
+        db.session.execute(insert.values({key_column: key, value_column: amount}).on_conflict_do_update(
+            index_elements=[key_column],
+            set_={value_column.key: value_column + amount}
+        ))
+    elif not model.query.filter(key_column == key).update({value_column: value_column + amount}, synchronize_session=False):
+        db.session.add(model(**{key_column.key: key, value_column.key: amount}))
+
 class User(db.Model):
+    # Serves the admin user listing filtered by role, in id order
+    __table_args__ = (
+        db.Index('ix_user_role_id', 'role', 'id'),
+        # LIKE 'prefix%' can only use an index built with the pattern operators
+        # under a locale collation. SQLite's LIKE is case-insensitive and can't
+        # use these or the unique indexes, so the search scans there
+        db.Index('ix_user_email_pattern', 'email', postgresql_ops={'email': 'varchar_pattern_ops'})
+            .ddl_if(dialect='postgresql'),
+        db.Index('ix_user_username_pattern', 'username', postgresql_ops={'username': 'varchar_pattern_ops'})
+            .ddl_if(dialect='postgresql'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -69,16 +95,39 @@ class Category(db.Model):
     products = db.relationship('Product', backref='category', lazy=True)
 
 class Product(db.Model):
+    # Composite indexes matching the filter/sort combinations produced by
+    # get_products; the trailing id serves the pagination tiebreaker.
+    __table_args__ = (
+        db.Index('ix_product_category_created_at', 'category_id', 'created_at', 'id'),
+        db.Index('ix_product_category_price', 'category_id', 'price', 'id'),
+        db.Index('ix_product_category_rating', 'category_id', 'overall_rating', 'id'),
+        db.Index('ix_product_created_at', 'created_at', 'id'),
+        db.Index('ix_product_price', 'price', 'id'),
+        db.Index('ix_product_rating', 'overall_rating', 'id'),
+        # Covers the facet counts query, which then never reads the table
+        db.Index('ix_product_facets', 'category_id', 'price', 'overall_rating'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     images = db.Column(db.JSON, nullable=True)
     stock_quantity = db.Column(db.Integer, nullable=False, default=0)
     price = db.Column(db.Float, nullable=False)
-    overall_rating = db.Column(db.Float, nullable=True)
+    overall_rating = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    # Review aggregates, maintained incrementally by apply_review_rating
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.Integer, default=get_current_timestamp)
+    # Bumped by every ORM and bulk UPDATE of the row, drives the detail ETag
+    updated_at = db.Column(db.Integer, default=get_current_timestamp, onupdate=get_current_timestamp)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     reviews = db.relationship('Review', backref='product', lazy=True)
 
     def update_stock(self, quantity):
@@ -89,20 +138,124 @@ class Product(db.Model):
         return False
 
     def calculate_rating(self):
-        """Calculate and update overall rating from reviews"""
-        if not self.reviews:
+        """Calculate overall rating from the maintained review aggregates"""
+        if not self.rating_count:
             return 0
-        self.overall_rating = sum(review.rating for review in self.reviews) / len(self.reviews)
-        return self.overall_rating
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_histogram(self):
+        return {stars: getattr(self, f'rating_count_{stars}') for stars in range(1, 6)}
+
+    @classmethod
+    def apply_review_rating(cls, product_id, rating, delta=1):
+        """Add (delta=1) or remove (delta=-1) a review's rating from the aggregates.
+
+        Runs as a single UPDATE computed from the current row values, so
+        concurrent review writes serialize on the row lock instead of losing
+        updates. Returns the number of products updated (0 if it doesn't exist).
+        """
+        rating_sum = cls.rating_sum + delta * rating
+        rating_count = cls.rating_count + delta
+        bucket = getattr(cls, f'rating_count_{rating}')
+        return cls.query.filter_by(id=product_id).update({
+            cls.rating_sum: rating_sum,
+            cls.rating_count: rating_count,
+            bucket: bucket + delta,
+            cls.overall_rating: db.case(
+                (rating_count > 0, db.cast(rating_sum, db.Float) / rating_count),
+                else_=0.0
+            ),
+        }, synchronize_session=False)
 
 class Review(db.Model):
+    # Serves get_reviews: filter by product, newest first
+    __table_args__ = (
+        db.Index('ix_review_product_created_at', 'product_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text, nullable=True)
     rating = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.Integer, default=get_current_timestamp)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) 
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    user = db.relationship('User', lazy=True)
 
 class BannedEmail(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
\ No newline at end of file
+    email = db.Column(db.String(120), unique=True, nullable=False)
+
+class ConfirmationCode(db.Model):
+    email = db.Column(db.String(120), primary_key=True)
+    code = db.Column(db.String(16), nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+class ImageBlob(db.Model):
+    """Number of Product.images entries referencing each stored upload.
+
+    Counts change through single upserts/updates inside the caller's
+    transaction, so concurrent product writes can't lose references.
+    """
+    path = db.Column(db.String(255), primary_key=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def retain(cls, paths, count=1):
+        """Add `count` references to every path, creating missing rows"""
+        for path in set(paths):
+            increment_counter(cls.path, path, cls.ref_count, count)
+
+    @classmethod
+    def lock(cls, path):
+        """Lock the path's row until the transaction ends, creating it without references if missing"""
+        increment_counter(cls.path, path, cls.ref_count, 0)
+
+    @classmethod
+    def claim_unreferenced(cls, paths):
+        """Lock every path's row and return the paths nothing references, deleting their rows.
+
+        Locking waits for a transaction that is storing one of the files
+        again (see FileHandler's before_store), so a file is only deleted if
+        that transaction didn't add a reference.
+        """
+        paths = sorted(set(paths))
+        if not paths:
+            return []
+        for path in paths:
+            cls.lock(path)
+        unreferenced = cls.query.filter(cls.path.in_(paths), cls.ref_count <= 0)
+        freed = [path for (path,) in unreferenced.with_entities(cls.path)]
+        unreferenced.delete(synchronize_session=False)
+        return freed
+
+    @classmethod
+    def release(cls, paths):
+        """Drop one reference from every path and return the paths nothing references anymore.
+
+        Paths without a row (uploads from before reference counting) are
+        never returned; orphaned files are left to garbage collection.
+        """
+        paths = set(paths)
+        if not paths:
+            return []
+        cls.query.filter(cls.path.in_(paths)).update(
+            {cls.ref_count: cls.ref_count - 1}, synchronize_session=False
+        )
+        unreferenced = cls.query.filter(cls.path.in_(paths), cls.ref_count <= 0)
+        freed = [path for (path,) in unreferenced.with_entities(cls.path)]
+        unreferenced.delete(synchronize_session=False)
+        return freed
+
+class StatCounter(db.Model):
+    """Running totals behind the admin dashboard, see app/utils/stats.py"""
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def adjust(cls, deltas):
+        """Add each delta to its counter in the caller's transaction"""
+        # A fixed order keeps concurrent transactions from deadlocking
+        for key, delta in sorted(deltas.items()):
+            if delta:
+                increment_counter(cls.key, key, cls.value, delta)
@@ -1,26 +1,74 @@
-from flask import jsonify, request, abort
+from flask import jsonify, request, abort, current_app, stream_with_context
 from flask_login import login_required, current_user
 from ..models import db, BannedEmail, User, Product, Category
+from .. import mail_queue
 from . import category_bp as main
+from ..utils.cache import catalog_cache, category_cache
+from .product_routes import title_index
+from ..utils.identity_cache import identity_cache
+from ..utils.compression import compressor
+from ..utils.metrics import metrics
+from ..utils.stats import record, user_deltas, snapshot, rebuild
+from ..utils.pagination import encode_cursor, decode_cursor, InvalidCursor
+from ..serializers import user_serializer, USER_LIST_FIELDS
+import hmac
 
 # USER MANAGEMENT ROUTES
 
 # Get general information about all users for admin dashboard
 
+def stream_users(query):
+    serialize = user_serializer.compile(USER_LIST_FIELDS)
+    dumps = current_app.json.dumps
+    for row in query.execution_options(yield_per=1000):
+        yield dumps(serialize(row)) + '\n'
+
 @main.route('/admin/users', methods=['GET'])
 @login_required
 def get_users():
     if not current_user.is_admin():
         abort(403)
-    
-    users = User.query.all()
-    return jsonify([{
-        'id': user.id,
-        'email': user.email,
-        'username': user.username,
-        'role': user.role,
-        'full_name': user.full_name,
-    } for user in users])
+
+    role = request.args.get('role', type=str)
+    # Prefix of the email or username, case-sensitive on Postgres
+    q = request.args.get('q', '', type=str)
+    cursor = request.args.get('cursor', '', type=str)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+
+    query = user_serializer.query(USER_LIST_FIELDS)
+    if role:
+        query = query.filter(User.role == role)
+    if q:
+        query = query.filter(db.or_(
+            User.email.startswith(q, autoescape=True),
+            User.username.startswith(q, autoescape=True)
+        ))
+    if cursor:
+        try:
+            _, last_id = decode_cursor(cursor, 'id')
+        except InvalidCursor as e:
+            abort(400, description=str(e))
+        query = query.filter(User.id > last_id)
+    query = query.order_by(User.id)
+
+    # Every matching user as NDJSON, for exports
+    if request.args.get('format') == 'ndjson':
+        return current_app.response_class(
+            stream_with_context(stream_users(query)),
+            mimetype='application/x-ndjson'
+        )
+
+    # One extra row tells whether there is a next page
+    users = query.limit(per_page + 1).all()
+    has_next = len(users) > per_page
+    users = users[:per_page]
+    serialize = user_serializer.compile(USER_LIST_FIELDS)
+    return jsonify({
+        'items': [serialize(user) for user in users],
+        'next_cursor': encode_cursor('id', users[-1].id, users[-1].id) if has_next else None,
+        'has_next': has_next,
+        'per_page': per_page
+    })
 
 # User full profile for admins
 
@@ -34,7 +82,7 @@ def get_user(user_id):
     if not user:
         return jsonify({'message': 'User not found'}), 404
     
-    return jsonify(user.to_dict()), 200
+    return jsonify(user_serializer.dump(user, user_serializer.fields)), 200
 
 # Delete a user, ban their email
 
@@ -52,10 +100,71 @@ def delete_user(user_id):
 
     db.session.add(banned_email)
     db.session.delete(user)
+    record(user_deltas(user.role, sign=-1))
     db.session.commit()
+    # Sessions of the deleted user stop authenticating right away
+    identity_cache.invalidate(user_id)
 
     return jsonify({'message': 'User deleted, email banned'}), 200
 
+# Dashboard statistics, read from precomputed counters
 
+@main.route('/admin/stats', methods=['GET'])
+@login_required
+def get_stats():
+    if not current_user.is_admin():
+        abort(403)
+
+    return jsonify(snapshot()), 200
+
+# Recompute the counters from the tables, e.g. after manual database edits
+
+@main.route('/admin/stats/rebuild', methods=['POST'])
+@login_required
+def rebuild_stats():
+    if not current_user.is_admin():
+        abort(403)
 
+    rebuild()
+    return jsonify(snapshot()), 200
+
+# Hit/miss counters of the response caches
+
+@main.route('/admin/cache-stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    if not current_user.is_admin():
+        abort(403)
+
+    return jsonify({
+        'catalog': catalog_cache.stats(),
+        'categories': category_cache.stats(),
+        'autocomplete': title_index.stats(),
+        'identity': identity_cache.stats(),
+        'compression': compressor.stats()
+    }), 200
+
+# Request, response size and SQL metrics in the Prometheus text format.
+# Scrapers without an admin session can send the METRICS_TOKEN as a bearer token.
+
+@main.route('/admin/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.enabled:
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())):
+        if not current_user.is_authenticated or not current_user.is_admin():
+            abort(403)
+
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Outbound mail queue depth and send latency
+
+@main.route('/admin/mail-stats', methods=['GET'])
+@login_required
+def get_mail_stats():
+    if not current_user.is_admin():
+        abort(403)
 
+    return jsonify(mail_queue.stats()), 200
@@ -1,15 +1,31 @@
-from flask import jsonify, request, abort
+from flask import jsonify, request, abort, current_app
 from flask_login import login_required, current_user
 from ..models import db, Category
+from ..serializers import category_serializer, CATEGORY_FIELDS
+from ..utils.cache import category_cache
 from . import category_bp as main
 
+def build_categories_snapshot():
+    """Serialize all categories with a denormalized product count each"""
+    rows = category_serializer.query(CATEGORY_FIELDS)\
+    .group_by(Category.id, Category.title)\
+    .order_by(Category.id)\
+    .all()
+    serialize = category_serializer.compile(CATEGORY_FIELDS)
+    return jsonify([serialize(row) for row in rows]).get_data()
+
 @main.route('/categories', methods=['GET'])
 def get_categories():
-    categories = Category.query.all()
-    return jsonify([{
-        'id': c.id,
-        'title': c.title
-    } for c in categories])
+    version = category_cache.version()
+    body = category_cache.get('all', version)
+    if body is None:
+        body = build_categories_snapshot()
+        category_cache.set('all', body, version)
+
+    # Strong ETag over the serialized body; answers If-None-Match with 304
+    response = current_app.response_class(body, mimetype='application/json')
+    response.add_etag()
+    return response.make_conditional(request)
 
 @main.route('/categories', methods=['POST'])
 @login_required
@@ -21,4 +37,5 @@ def create_category():
     category = Category(title=data['title'])
     db.session.add(category)
     db.session.commit()
+    category_cache.bump()
     return jsonify({'message': 'Category created', 'id': category.id}), 201
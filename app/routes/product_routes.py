@@ -1,94 +1,341 @@
-from flask import jsonify, request, abort, send_from_directory, url_for
+from flask import jsonify, request, abort, send_from_directory, url_for, current_app, stream_with_context
 from flask_login import login_required, current_user
-from ..models import db, Product, Category
+from ..models import db, Product, Category, ImageBlob
 from . import product_bp as main
 from ..utils.file_handler import FileHandler
+from ..utils.pagination import encode_cursor, decode_cursor, InvalidCursor
+from ..utils.cache import catalog_cache, category_cache
+from ..utils.search import search_products, search_terms
+from ..utils.autocomplete import TitleIndex
+from ..utils.image_pipeline import image_pipeline, original_path
+from ..utils.stats import record, product_deltas
+from ..utils.facets import parse_facets, count_facets, range_value, RATING_MAX
+from ..utils.product_import import ProductImporter, ZipImport, InvalidImport, READERS, import_format
+from ..serializers import (
+    product_serializer, UnknownFields, PRODUCT_LIST_FIELDS, PRODUCT_DETAIL_FIELDS, CREATED_PRODUCT_FIELDS
+)
 import os
+import re
+import csv
+import io
+import json
+import mimetypes
+from urllib.parse import quote
+from datetime import datetime, timezone
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 
-# Initialize file handler with upload folder from config
-file_handler = FileHandler(os.getenv('UPLOADS_FOLDER'))
+# Initialize file handler with upload folder from config. Locking the blob's
+# row before a file is written keeps discard_images from deleting a
+# deduplicated file that this transaction is about to reference again.
+file_handler = FileHandler(
+    os.getenv('UPLOADS_FOLDER'),
+    content_addressed=os.getenv('UPLOADS_CONTENT_ADDRESSED', 'false').lower() == 'true',
+    before_store=ImageBlob.lock
+)
 
-@main.route('/products', methods=['GET'])
-def get_products():
+# Content-addressed uploads (products/ab/cd/<sha256>.<ext>) and their variants
+IMMUTABLE_IMAGE = re.compile(r'(^|/)[0-9a-f]{64}\.(png|jpg|gif)(__\w+\.\w+)?$')
 
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+# Prefix index backing the search box autocomplete
+title_index = TitleIndex(
+    max_entries=int(os.getenv('AUTOCOMPLETE_MAX_ENTRIES', 200000)),
+    max_age=int(os.getenv('AUTOCOMPLETE_MAX_AGE', 300))
+)
 
-    category_id = request.args.get('category_id', type=int)
-    price_range = request.args.get('price_range', type=str)
-    rating_range = request.args.get('rating_range', type=str)
-    order_by = request.args.get('order_by', 'created_at', type=str)
-    liked = request.args.get('liked', type=bool)
-    
-    query = Product.query.options(
-        db.joinedload(Product.category),
-        db.joinedload(Product.user)
-    )
-    
-    # Apply filters if provided
+# Sort column and direction for every supported order_by value. The product
+# id is always appended as a tiebreaker so that ordering is deterministic,
+# which both offset and cursor pagination rely on.
+PRODUCT_ORDERINGS = {
+    'created_at': (Product.created_at, 'desc'),
+    'price_descending': (Product.price, 'desc'),
+    'price_ascending': (Product.price, 'asc'),
+    'rating': (Product.overall_rating, 'desc'),
+}
+
+def process_images(paths):
+    """Queue variant generation, skipping deduplicated uploads that already have them"""
+    for path in paths:
+        if not image_pipeline.has_variants(path):
+            image_pipeline.submit(path)
+
+def discard_images(paths):
+    """Delete stored images and their variants unless a product references them again"""
+    if not paths:
+        return
+    # Row locks are held while deleting, so an upload storing one of these again waits
+    for path in ImageBlob.claim_unreferenced(paths):
+        file_handler.delete_file(path)
+        image_pipeline.delete_variants(path)
+    db.session.commit()
+
+def filter_products(query, category_id=None, price_range=None, rating_range=None, liked=False,
+                    price_bucket=None, rating_bucket=None):
+    """Apply the listing filters shared by all product queries"""
     if liked:
         liked_products = current_user.liked_products.split(',')
         query = query.filter(Product.id.in_(liked_products))
     if category_id:
-        query = query.filter_by(category_id=category_id)
+        query = query.filter(Product.category_id == category_id)
     if price_range:
-        min_price, max_price = map(float, price_range.split(','))
-        query = query.filter(Product.price >= min_price, Product.price <= max_price)
+        query = filter_range(query, Product.price, price_range)
     if rating_range:
-        min_rating, max_rating = map(float, rating_range.split(','))
-        query = query.filter(Product.overall_rating >= min_rating, Product.overall_rating <= max_rating)
+        query = filter_range(query, Product.overall_rating, rating_range)
+    # Facet bucket drill-down, see filter_range
+    if price_bucket:
+        query = filter_range(query, Product.price, price_bucket, exclusive=True)
+    if rating_bucket:
+        query = filter_range(query, Product.overall_rating, rating_bucket, exclusive=True, upper_limit=RATING_MAX)
+    return query
+
+def filter_range(query, column, value, exclusive=False, upper_limit=None):
+    """Restrict `column` to a 'min,max' range, an empty max ('1000,') leaves it open-ended.
+
+    Both bounds are inclusive. With `exclusive` the max is excluded, which
+    matches the facet buckets so a bucket never overlaps the next one; a max
+    at `upper_limit`, the top of the scale, is still included.
+    """
+    lower, _, upper = value.partition(',')
+    query = query.filter(column >= float(lower))
+    if upper:
+        if not exclusive or (upper_limit is not None and float(upper) >= upper_limit):
+            query = query.filter(column <= float(upper))
+        else:
+            query = query.filter(column < float(upper))
+    return query
+
+def order_products(query, order_by):
+    """Sort products, falling back to newest first for unknown values"""
+    column, direction = PRODUCT_ORDERINGS.get(order_by, PRODUCT_ORDERINGS['created_at'])
+    if direction == 'desc':
+        return query.order_by(column.desc(), Product.id.desc())
+    return query.order_by(column.asc(), Product.id.asc())
+
+def seek_products(query, order_by, sort_value, last_id):
+    """Restrict the query to rows after the given sort key (keyset pagination)"""
+    column, direction = PRODUCT_ORDERINGS.get(order_by, PRODUCT_ORDERINGS['created_at'])
+    if direction == 'desc':
+        return query.filter(db.tuple_(column, Product.id) < (sort_value, last_id))
+    return query.filter(db.tuple_(column, Product.id) > (sort_value, last_id))
+
+def parse_fields(value):
+    """Requested listing fields in canonical order, all of them by default"""
+    try:
+        # The id is always returned, clients need it to link to the product
+        return product_serializer.parse_fields(value, PRODUCT_LIST_FIELDS)
+    except UnknownFields as e:
+        abort(400, description=str(e))
+
+def sort_column(order_by):
+    return PRODUCT_ORDERINGS.get(order_by, PRODUCT_ORDERINGS['created_at'])[0]
+
+def product_list_query(fields, order_by):
+    """Column query selecting what `fields` and the sort key need, without hydrating ORM objects"""
+    # Cursor pagination reads the sort value from the last row
+    return product_serializer.query(fields, extra=(sort_column(order_by),))
+
+def normalize_range(value):
+    """Canonical form of a 'min,max' filter, so equivalent queries share a cache key"""
+    if not value:
+        return ''
+    lower, _, upper = value.partition(',')
+    try:
+        return range_value(float(lower), float(upper) if upper else None)
+    except ValueError:
+        abort(400, description=f"Invalid range: {value}")
+
+def product_facets(category_id, price_range, rating_range, liked, q, names, price_bucket=None, rating_bucket=None):
+    """Facet counts for the listing filters, cached per normalized filter set across pages and orderings"""
+    cache_key = None
+    if not liked:
+        cache_key = f'facets|{category_id or ""}|{price_range}|{rating_range}|{price_bucket}|{rating_bucket}|{q}|{",".join(names)}'
+        version = catalog_cache.version()
+        cached = catalog_cache.get(cache_key, version)
+        if cached is not None:
+            return json.loads(cached)
+
+    query = filter_products(
+        Product.query, category_id, price_range, rating_range, liked,
+        price_bucket=price_bucket, rating_bucket=rating_bucket
+    )
+    if q:
+        query, _ = search_products(query, q)
+    facets = count_facets(query, names)
+    if cache_key:
+        catalog_cache.set(cache_key, json.dumps(facets).encode(), version)
+    return facets
+
+def list_products(category_id, price_range, rating_range, order_by, liked, q, page, per_page, cursor, fields,
+                  price_bucket=None, rating_bucket=None):
+    query = product_list_query(fields, order_by)
+    serialize = product_serializer.compile(fields, extra=(sort_column(order_by),))
+    # Counts the same rows without the joins only needed for display
+    count_query = db.session.query(Product.id)
+    
+    # Apply filters if provided
+    buckets = {'price_bucket': price_bucket, 'rating_bucket': rating_bucket}
+    query = filter_products(query, category_id, price_range, rating_range, liked, **buckets)
+    count_query = filter_products(count_query, category_id, price_range, rating_range, liked, **buckets)
+    if q:
+        query, relevance = search_products(query, q)
+        count_query, _ = search_products(count_query, q)
     
     # Sort products
-    if order_by == 'price_descending':
-        query = query.order_by(Product.price.desc())
-    elif order_by == 'price_ascending':
-        query = query.order_by(Product.price.asc())
-    elif order_by == 'rating':
-        query = query.order_by(Product.overall_rating.desc())
-    elif order_by == 'created_at':
-        query = query.order_by(Product.created_at.desc())
-    else: 
-        query = query.order_by(Product.created_at.desc())
+    if order_by == 'relevance':
+        query = query.order_by(relevance, Product.id.desc())
+    else:
+        query = order_products(query, order_by)
+
+    if cursor is not None:
+        if order_by == 'relevance':
+            abort(400, description="Cursor pagination is not supported when ordering by relevance")
+        if cursor:
+            try:
+                sort_value, last_id = decode_cursor(cursor, order_by)
+            except InvalidCursor as e:
+                abort(400, description=str(e))
+            query = seek_products(query, order_by, sort_value, last_id)
+
+        # Fetch one extra row to find out whether there is a next page,
+        # instead of running a COUNT(*) over the filtered query
+        products = query.limit(per_page + 1).all()
+        has_next = len(products) > per_page
+        products = products[:per_page]
+
+        next_cursor = None
+        if has_next:
+            column = PRODUCT_ORDERINGS[order_by][0]
+            last = products[-1]
+            next_cursor = encode_cursor(order_by, getattr(last, column.key), last.id)
+
+        return {
+            'items': [serialize(p) for p in products],
+            'next_cursor': next_cursor,
+            'has_next': has_next,
+            'per_page': per_page
+        }
     
     # Paginate
-    products = query.paginate(page=page, per_page=per_page)
+    products = query.paginate(page=page, per_page=per_page, count=False)
+    products.total = count_query.count()
     
-    return jsonify({
-        'items': [{
-            'id': p.id,
-            'title': p.title,
-            'description': p.description,
-            'price': p.price,
-            'stock_quantity': p.stock_quantity,
-            'images': p.images,
-            'overall_rating': p.overall_rating,
-            'category_id': p.category_id,
-            'category_name': p.category.title,
-            'seller_name': p.user.username
-        } for p in products.items],
+    return {
+        'items': [serialize(p) for p in products.items],
         'total': products.total,
         'pages': products.pages,
         'current_page': products.page,
         'has_next': products.has_next,
         'has_prev': products.has_prev
+    }
+
+@main.route('/products', methods=['GET'])
+def get_products():
+
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 200)
+
+    category_id = request.args.get('category_id', type=int)
+    price_range = normalize_range(request.args.get('price_range', type=str))
+    rating_range = normalize_range(request.args.get('rating_range', type=str))
+    # A facet bucket's `bucket` value, which unlike the ranges excludes its max
+    price_bucket = normalize_range(request.args.get('price_bucket', type=str))
+    rating_bucket = normalize_range(request.args.get('rating_bucket', type=str))
+    liked = request.args.get('liked', type=bool)
+    # Full-text search, combined with the filters above
+    q = ' '.join(search_terms(request.args.get('q', '', type=str)))
+    # Search results are ranked by relevance unless asked otherwise
+    order_by = request.args.get('order_by', 'relevance' if q else 'created_at', type=str)
+    # Passing `cursor` (empty for the first page) opts into keyset pagination
+    cursor = request.args.get('cursor', type=str)
+    # Counts for the filter sidebar, e.g. facets=category,price,rating
+    facet_names = parse_facets(request.args.get('facets', type=str))
+    # Sparse fieldsets, e.g. fields=id,title,price,image_variants for cards
+    fields = parse_fields(request.args.get('fields', type=str))
+
+    if order_by not in PRODUCT_ORDERINGS and not (q and order_by == 'relevance'):
+        order_by = 'created_at'
+
+    # Liked products depend on the current user, everything else is shared
+    cache_key = None
+    if not liked:
+        position = f'cursor={cursor}' if cursor is not None else f'page={page}'
+        cache_key = f'products|{category_id or ""}|{price_range}|{rating_range}|{price_bucket}|{rating_bucket}|{q}|{order_by}|{per_page}|{position}|{",".join(facet_names)}|{",".join(fields)}'
+        # Read once, so a body built from pre-write data is stored under the old version
+        version = catalog_cache.version()
+        body = catalog_cache.get(cache_key, version)
+        if body is not None:
+            response = current_app.response_class(body, mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+    buckets = {'price_bucket': price_bucket, 'rating_bucket': rating_bucket}
+    result = list_products(
+        category_id, price_range, rating_range, order_by, liked, q, page, per_page, cursor, fields, **buckets
+    )
+    if facet_names:
+        result['facets'] = product_facets(category_id, price_range, rating_range, liked, q, facet_names, **buckets)
+    response = jsonify(result)
+    if cache_key:
+        catalog_cache.set(cache_key, response.get_data(), version)
+        response.headers['X-Cache'] = 'MISS'
+    return response
+
+def title_rows(app):
+    """Loader for the title index, also usable from its background rebuild thread"""
+    def load():
+        with app.app_context():
+            # Newest products win when the catalog exceeds the index size
+            rows = db.session.query(Product.id, Product.title, Product.category_id)\
+                .order_by(Product.id.desc())\
+                .limit(title_index.max_entries)\
+                .all()
+        return reversed(rows)
+    return load
+
+@main.route('/products/autocomplete', methods=['GET'])
+def autocomplete_products():
+    prefix = request.args.get('prefix', '', type=str)
+    category_id = request.args.get('category_id', type=int)
+    limit = min(request.args.get('limit', 10, type=int), 20)
+
+    title_index.refresh(title_rows(current_app._get_current_object()))
+
+    return jsonify({
+        'suggestions': [{
+            'id': id,
+            'title': title
+        } for id, title in title_index.search(prefix, category_id, limit)]
     })
 
+def product_validators(id):
+    """Return (etag, last_modified) for a product from a single primary key lookup"""
+    row = db.session.query(
+        db.func.coalesce(Product.updated_at, Product.created_at)
+    ).filter(Product.id == id).first()
+    if row is None:
+        abort(404)
+    updated_at = row[0] or 0
+    return f'{id}-{updated_at}', datetime.fromtimestamp(updated_at / 1000, tz=timezone.utc)
+
 @main.route('/products/<int:id>', methods=['GET'])
 def get_product(id):
-    product = Product.query.get_or_404(id)
-    
-    return jsonify({
-        'id': product.id,
-        'title': product.title,
-        'description': product.description,
-        'price': product.price,
-        'stock_quantity': product.stock_quantity,
-        'images': product.images,
-        'overall_rating': product.overall_rating,
-        'category_id': product.category_id,
-        'category_name': product.category.title,
-        'seller_username': product.user.username
-    })
+    # Answer revalidations without loading the product and its relations
+    etag, last_modified = product_validators(id)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    row = product_serializer.query(PRODUCT_DETAIL_FIELDS).filter(Product.id == id).first()
+    if row is None:
+        abort(404)
+
+    response = jsonify(product_serializer.compile(PRODUCT_DETAIL_FIELDS)(row))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Let clients keep the body but revalidate it on every use
+    response.cache_control.no_cache = True
+    return response
 
 
 @main.route('/products', methods=['POST'])
@@ -144,35 +391,145 @@ def create_product():
         )
         
         db.session.add(new_product)
+        ImageBlob.retain(image_paths)
+        record(product_deltas(new_product.category_id, stock))
         db.session.commit()
+        catalog_cache.bump()
+        category_cache.bump()
+        title_index.add(new_product.id, new_product.title, new_product.category_id)
+
+        # Resize in the background, the response doesn't wait for it
+        process_images(image_paths)
         
         # Convert relative paths to full URLs in response
         image_urls = [
-            url_for('main.get_image', filename=path, _external=True)
+            url_for('product.get_image', filename=path, _external=True)
             for path in image_paths
         ]
+        variant_urls = [{
+            variant: url_for('product.get_image', filename=variant_path, _external=True)
+            for variant, variant_path in variants.items()
+        } for variants in image_pipeline.variants_for(image_paths)]
         
         return jsonify({
             'message': 'Product created successfully',
             'product': {
-                'id': new_product.id,
-                'title': new_product.title,
-                'description': new_product.description,
-                'price': new_product.price,
-                'stock_quantity': new_product.stock_quantity,
+                **product_serializer.dump(new_product, CREATED_PRODUCT_FIELDS),
                 'images': image_urls,
-                'category_id': new_product.category_id,
-                'user_id': new_product.user_id
+                'image_variants': variant_urls
             }
         }), 201
         
     except Exception as e:
         db.session.rollback()
-        # Clean up uploaded files if product creation fails
-        for path in image_paths:
-            file_handler.delete_file(path)
+        # Clean up uploaded files if product creation fails, unless they are
+        # deduplicated copies of images other products use
+        discard_images(image_paths)
         abort(500, description=str(e))
 
+# Columns written by the export, the import reads the same names
+EXPORT_COLUMNS = (
+    Product.id, Product.title, Product.description, Product.price, Product.stock_quantity,
+    Product.category_id, Product.user_id, Product.images, Product.overall_rating,
+    Product.rating_count, Product.created_at,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+def export_chunks(query, fmt, rows_per_chunk=500):
+    """Encode query rows as CSV or NDJSON, yielding a chunk of text every few hundred rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    dumps = current_app.json.dumps
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(query, start=1):
+        if writer:
+            writer.writerow([';'.join(value or []) if key == 'images' else value for key, value in zip(EXPORT_FIELDS, row)])
+        else:
+            buffer.write(dumps(dict(zip(EXPORT_FIELDS, row))))
+            buffer.write('\n')
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@main.route('/products/export', methods=['GET'])
+@login_required
+def export_products():
+    if not (current_user.is_admin() or current_user.is_seller()):
+        abort(403, description="Only admins and sellers can export products")
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        abort(400, description="format must be ndjson or csv")
+    # Sellers only ever get their own products
+    seller_id = current_user.id if current_user.is_seller() else request.args.get('seller_id', type=int)
+    category_id = request.args.get('category_id', type=int)
+    # Resume an interrupted export after the last id received
+    after_id = request.args.get('after_id', 0, type=int)
+
+    query = db.session.query(*EXPORT_COLUMNS).filter(Product.id > after_id)
+    if seller_id:
+        query = query.filter(Product.user_id == seller_id)
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    # Fetched from a server-side cursor in batches, memory stays flat
+    query = query.order_by(Product.id).execution_options(yield_per=1000)
+
+    response = current_app.response_class(
+        stream_with_context(export_chunks(query, fmt)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
+
+@main.route('/products/import', methods=['POST'])
+@login_required
+def import_products():
+    if not current_user.is_seller():
+        abort(403, description="Only sellers can import products")
+    # Catalog files may be far larger than a regular upload
+    request.max_content_length = current_app.config['IMPORT_MAX_CONTENT_LENGTH']
+
+    # Either a raw body or a multipart upload in the "file" field
+    if request.mimetype == 'multipart/form-data':
+        file = request.files.get('file')
+        if not file:
+            abort(400, description="Missing file")
+        stream, mimetype, filename = file.stream, file.mimetype, file.filename
+    else:
+        stream, mimetype, filename = request.stream, request.mimetype, None
+
+    archive = None
+    try:
+        fmt = import_format(mimetype, filename, request.args.get('format'))
+        category_ids = {id for (id,) in db.session.query(Category.id)}
+        importer = ProductImporter(current_user.id, category_ids, file_handler)
+        if fmt == 'zip':
+            archive = ZipImport(stream)
+            summary = importer.run(archive.records(), archive.open_image)
+        else:
+            summary = importer.run(READERS[fmt](stream))
+    except InvalidImport as e:
+        abort(400, description=str(e))
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Batches before the unreadable part stay imported
+        summary = {'imported': importer.imported, 'failed': importer.error_count, 'errors': importer.errors}
+        summary['aborted'] = f'Could not read the file: {e}'
+    finally:
+        if archive:
+            archive.close()
+
+    discard_images(importer.failed_images)
+    if summary['imported']:
+        catalog_cache.bump()
+        category_cache.bump()
+        title_index.invalidate()
+        process_images(set(importer.stored_images))
+    # 400 only when nothing got in, because every row failed or the file couldn't be read
+    failed = summary['failed'] or 'aborted' in summary
+    return jsonify(summary), 200 if summary['imported'] or not failed else 400
+
 @main.route('/products/<int:id>', methods=['PUT'])
 @login_required
 def update_product(id):
@@ -190,20 +547,32 @@ def update_product(id):
     
     if not image_paths and files:
         abort(400, description="Failed to upload images")
+    process_images(image_paths)
 
     data = request.get_json()
     
-    # Maintain links to unchanged images
-    unchanged_images = data.get('images', [])
+    # Maintain links to unchanged images; only the product's own can be kept
+    old_images = set(product.images or [])
+    unchanged_images = [path for path in data.get('images', []) if path in old_images]
 
     image_paths.extend(unchanged_images)
+    ImageBlob.retain(set(image_paths) - old_images)
+    dropped_images = ImageBlob.release(old_images - set(image_paths))
     product.images = image_paths
 
     product.title = data.get('title', product.title)
     product.description = data.get('description', product.description)
     product.price = data.get('price', product.price)
+    old_stock = product.stock_quantity
     product.stock_quantity = data.get('stock_quantity', product.stock_quantity)
+    record(
+        product_deltas(product.category_id, int(product.stock_quantity)),
+        product_deltas(product.category_id, old_stock, sign=-1)
+    )
     db.session.commit()
+    discard_images(dropped_images)
+    catalog_cache.bump()
+    title_index.add(product.id, product.title, product.category_id)
     return jsonify({'message': 'Product updated'})
 
 @main.route('/products/<int:id>', methods=['DELETE'])
@@ -213,11 +582,48 @@ def delete_product(id):
     if product.user_id != current_user.id:
         abort(403)
     
+    unreferenced_images = ImageBlob.release(product.images or [])
+    record(product_deltas(product.category_id, product.stock_quantity, sign=-1))
     db.session.delete(product)
     db.session.commit()
+    discard_images(unreferenced_images)
+    catalog_cache.bump()
+    category_cache.bump()
+    title_index.remove(id)
     return jsonify({'message': 'Product deleted'})
 
 # Add route to serve images
 @main.route('/uploads/<path:filename>')
 def get_image(filename):
-    return send_from_directory(os.getenv("UPLOADS_FOLDER"), filename)
+    upload_folder = os.getenv("UPLOADS_FOLDER")
+    full_path = safe_join(upload_folder, filename)
+    if full_path is None:
+        abort(404)
+    # Variants are generated in the background, serve the original until they exist
+    served = filename
+    if not os.path.exists(full_path):
+        served = original_path(filename) or filename
+
+    if current_app.config.get('IMAGE_SERVING') == 'x-accel':
+        # nginx sends the file from an internal location and handles
+        # ETag/Range itself, this process only sends the headers
+        if not os.path.isfile(safe_join(upload_folder, served)):
+            abort(404)
+        response = current_app.response_class(mimetype=mimetypes.guess_type(served)[0] or 'application/octet-stream')
+        prefix = current_app.config['IMAGE_X_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{prefix}/{quote(served)}'
+    else:
+        # Conditional and Range requests are answered by send_file, which
+        # emits X-Sendfile instead of the body when USE_X_SENDFILE is set
+        response = send_from_directory(upload_folder, served)
+
+    if served != filename:
+        # Revalidate so clients pick up the variant once it's generated
+        response.cache_control.no_cache = True
+    elif IMMUTABLE_IMAGE.search(filename):
+        # Content-addressed names never change content
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
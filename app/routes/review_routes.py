@@ -1,29 +1,31 @@
 from flask import jsonify, request, abort
 from flask_login import login_required, current_user
-from ..models import db, Review
+from ..models import db, Product, Review
 from . import review_bp as main
+from ..utils.cache import catalog_cache
+from ..utils.stats import record, review_deltas
+from ..serializers import review_serializer, REVIEW_FIELDS
 
 @main.route('/products/<int:product_id>/reviews', methods=['GET'])
 def get_reviews(product_id):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 5, type=int)
+
+    # The review count is maintained on the product, so there is no need
+    # to run a COUNT(*) over the reviews table
+    total = db.session.query(Product.rating_count).filter_by(id=product_id).scalar()
+    if total is None:
+        abort(404)
     
-    reviews = Review.query.options(
-        db.joinedload(Review.user)
-    ).filter_by(product_id=product_id)\
-    .order_by(Review.created_at.desc())\
-    .paginate(page=page, per_page=per_page)
+    reviews = review_serializer.query(REVIEW_FIELDS)\
+    .filter(Review.product_id == product_id)\
+    .order_by(Review.created_at.desc(), Review.id.desc())\
+    .paginate(page=page, per_page=per_page, count=False)
+    reviews.total = total
+    serialize = review_serializer.compile(REVIEW_FIELDS)
     
     return jsonify({
-        'items': [{
-            'id': r.id,
-            'body': r.body,
-            'rating': r.rating,
-            'created_at': r.created_at,
-            'user_id': r.user_id,
-            'username': r.user.username,
-            'product_id': r.product_id
-        } for r in reviews.items],
+        'items': [serialize(r) for r in reviews.items],
         'total': reviews.total,
         'pages': reviews.pages,
         'current_page': reviews.page,
@@ -38,14 +40,25 @@ def create_review(product_id):
         abort(403)
     
     data = request.get_json()
+    rating = data.get('rating')
+    if not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5:
+        abort(400, description="Rating must be an integer from 1 to 5")
+
     review = Review(
         body=data.get('body'),
-        rating=data['rating'],
+        rating=rating,
         product_id=product_id,
         user_id=current_user.id
     )
     db.session.add(review)
+    # Update the product's rating aggregates in the same transaction
+    if not Product.apply_review_rating(product_id, rating):
+        db.session.rollback()
+        abort(404)
+    record(review_deltas(rating))
     db.session.commit()
+    # Ratings feed the listing's filters and sort order
+    catalog_cache.bump()
     return jsonify({'message': 'Review created', 'id': review.id}), 201
 
 @main.route('/reviews/<int:id>', methods=['DELETE'])
@@ -55,6 +68,11 @@ def delete_review(id):
     if review.user_id != current_user.id and not current_user.is_admin():
         abort(403)
     
-    db.session.delete(review)
+    # Only the request that actually removes the row adjusts the aggregates,
+    # so concurrent deletes of the same review can't double count
+    if Review.query.filter_by(id=review.id).delete():
+        Product.apply_review_rating(review.product_id, review.rating, delta=-1)
+        record(review_deltas(review.rating, sign=-1))
     db.session.commit()
-    return jsonify({'message': 'Review deleted'})
\ No newline at end of file
+    catalog_cache.bump()
+    return jsonify({'message': 'Review deleted'})
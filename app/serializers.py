@@ -0,0 +1,205 @@
+from operator import attrgetter, itemgetter
+from . import db
+from .models import Product, Category, User, Review
+from .utils.image_pipeline import image_pipeline
+
+
+class UnknownFields(ValueError):
+    pass
+
+
+class Field:
+    """A response key read from one or more columns, optionally transformed.
+
+    `join` is the (entity, onclause) the columns need when they don't belong
+    to the serializer's model; it is outer-joined only when the field is
+    requested.
+    """
+
+    def __init__(self, *columns, transform=None, join=None):
+        self.columns = columns
+        self.transform = transform
+        self.join = join
+
+
+class Serializer:
+    """Turns rows of a column query into response dicts.
+
+    compile() builds a function per requested field set that reads every
+    column value with one itemgetter over precomputed tuple positions, so no
+    ORM objects are hydrated and field names aren't looked up per row. The
+    functions are cached, field sets come from a small fixed vocabulary.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self._compiled = {}
+
+    def parse_fields(self, value, default, required=('id',)):
+        """Requested field names in declaration order, `default` when none are given"""
+        if not value:
+            return tuple(default)
+        requested = {field.strip() for field in value.split(',') if field.strip()}
+        unknown = requested - set(self.fields)
+        if unknown:
+            raise UnknownFields(f"Unknown fields: {', '.join(sorted(unknown))}")
+        requested.update(required)
+        return tuple(field for field in self.fields if field in requested)
+
+    def columns(self, names, extra=()):
+        """Columns to select for `names`, plus `extra` ones the caller needs (e.g. a sort key)"""
+        columns = {}
+        for name in names:
+            for column in self.fields[name].columns:
+                columns.setdefault(column.key, column)
+        for column in extra:
+            columns.setdefault(column.key, column)
+        return list(columns.values())
+
+    def query(self, names, extra=()):
+        query = db.session.query(*self.columns(names, extra)).select_from(self.model)
+        joined = []
+        for name in names:
+            join = self.fields[name].join
+            if join is not None and join[0] not in joined:
+                query = query.outerjoin(*join)
+                joined.append(join[0])
+        return query
+
+    def compile(self, names, extra=(), by_attribute=False):
+        """Serializer function for rows from query(names, extra).
+
+        With by_attribute, values are read as attributes instead, which also
+        works for model instances as long as no joined fields are requested.
+        """
+        key = (tuple(names), tuple(column.key for column in extra), by_attribute)
+        if key in self._compiled:
+            return self._compiled[key]
+
+        positions = {column.key: index for index, column in enumerate(self.columns(names, extra))}
+        # Every field's columns in request order, read in one call
+        column_keys = [column.key for name in names for column in self.fields[name].columns]
+        if by_attribute:
+            getter = attrgetter(*column_keys)
+        else:
+            getter = itemgetter(*(positions[column_key] for column_key in column_keys))
+        if len(column_keys) == 1:
+            # A single-item getter returns the value itself rather than a tuple
+            single = getter
+
+            def getter(row):
+                return (single(row),)
+
+        # (key, first value, end of its values, transform) per field
+        steps = []
+        start = 0
+        for name in names:
+            field = self.fields[name]
+            stop = start + len(field.columns)
+            steps.append((name, start, stop, field.transform))
+            start = stop
+
+        if all(transform is None for _, _, _, transform in steps):
+            names = tuple(names)
+
+            def serialize(row):
+                return dict(zip(names, getter(row)))
+        else:
+            def serialize(row):
+                values = getter(row)
+                return {
+                    name: values[start] if transform is None else transform(*values[start:stop])
+                    for name, start, stop, transform in steps
+                }
+
+        self._compiled[key] = serialize
+        return serialize
+
+    def dump(self, obj, names):
+        """Serialize a single row or model instance by attribute"""
+        return self.compile(names, by_attribute=True)(obj)
+
+
+def rating_histogram(*counts):
+    return {stars: count for stars, count in enumerate(counts, start=1)}
+
+
+category_name = Category.title.label('category_name')
+seller_name = User.username.label('seller_name')
+seller_username = User.username.label('seller_username')
+review_username = User.username.label('username')
+
+product_serializer = Serializer(Product, {
+    'id': Field(Product.id),
+    'title': Field(Product.title),
+    'description': Field(Product.description),
+    'price': Field(Product.price),
+    'stock_quantity': Field(Product.stock_quantity),
+    'images': Field(Product.images),
+    'image_variants': Field(Product.images, transform=image_pipeline.variants_for),
+    'overall_rating': Field(Product.overall_rating),
+    'review_count': Field(Product.rating_count),
+    'rating_histogram': Field(
+        Product.rating_count_1, Product.rating_count_2, Product.rating_count_3,
+        Product.rating_count_4, Product.rating_count_5,
+        transform=rating_histogram
+    ),
+    'category_id': Field(Product.category_id),
+    'category_name': Field(category_name, join=(Category, Product.category_id == Category.id)),
+    'seller_name': Field(seller_name, join=(User, Product.user_id == User.id)),
+    'seller_username': Field(seller_username, join=(User, Product.user_id == User.id)),
+    'user_id': Field(Product.user_id),
+})
+
+# Listing cards and the product page
+PRODUCT_LIST_FIELDS = (
+    'id', 'title', 'description', 'price', 'stock_quantity', 'images', 'image_variants',
+    'overall_rating', 'review_count', 'category_id', 'category_name', 'seller_name',
+)
+PRODUCT_DETAIL_FIELDS = (
+    'id', 'title', 'description', 'price', 'stock_quantity', 'images', 'image_variants',
+    'overall_rating', 'review_count', 'rating_histogram', 'category_id', 'category_name',
+    'seller_username',
+)
+# Echoed back by the create endpoint, which adds image URLs itself
+CREATED_PRODUCT_FIELDS = ('id', 'title', 'description', 'price', 'stock_quantity', 'category_id', 'user_id')
+
+review_serializer = Serializer(Review, {
+    'id': Field(Review.id),
+    'body': Field(Review.body),
+    'rating': Field(Review.rating),
+    'created_at': Field(Review.created_at),
+    'user_id': Field(Review.user_id),
+    'username': Field(review_username, join=(User, Review.user_id == User.id)),
+    'product_id': Field(Review.product_id),
+})
+REVIEW_FIELDS = tuple(review_serializer.fields)
+
+user_serializer = Serializer(User, {
+    'id': Field(User.id),
+    'email': Field(User.email),
+    'username': Field(User.username),
+    'role': Field(User.role),
+    'full_name': Field(User.full_name),
+    'address': Field(User.address),
+    'card_number': Field(User.card_number),
+    'support_email': Field(User.support_email),
+})
+# What the identity cache holds, enough for most authenticated requests
+USER_IDENTITY_FIELDS = ('id', 'email', 'username', 'role')
+# Admin user listing
+USER_LIST_FIELDS = ('id', 'email', 'username', 'role', 'full_name')
+# What a user sees about their own account
+USER_ACCOUNT_FIELDS = ('id', 'email', 'username', 'role', 'full_name', 'address', 'card_number')
+
+category_serializer = Serializer(Category, {
+    'id': Field(Category.id),
+    'title': Field(Category.title),
+    'product_count': Field(
+        db.func.count(Product.id).label('product_count'),
+        join=(Product, Product.category_id == Category.id)
+    ),
+})
+# Counted per category, the query groups by the other fields
+CATEGORY_FIELDS = tuple(category_serializer.fields)
@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title):
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    title = unicodedata.normalize('NFKD', title or '')
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', title.casefold()))
+
+
+class TitleIndex:
+    """In-memory prefix index over normalized product titles.
+
+    Each title is indexed under its first `max_words` word positions, so
+    "wire" finds both "Wireless charger" and "Anker wireless charger". Keys
+    live in sorted lists (one global, one per category), making a lookup a
+    bisect plus a scan over the matches. At most `max_entries` products are
+    kept, the oldest are evicted first. The index is built lazily on first
+    use and rebuilt after `max_age` seconds to pick up writes made by other
+    worker processes; writes in this process are applied incrementally.
+    Only the first build blocks searches: later rebuilds run in a single
+    background thread while the stale index keeps answering.
+    """
+
+    def __init__(self, max_entries=200000, max_words=4, max_key_length=64, max_age=300):
+        self.max_entries = max_entries
+        self.max_words = max_words
+        self.max_key_length = max_key_length
+        self.max_age = max_age
+        self._built_at = None
+        self._invalidated_at = None
+        self._lock = threading.RLock()
+        # Held by whoever is building, so there is only ever one build
+        self._build_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._keys = []
+        self._keys_by_category = {}
+        # product_id -> (title, category_id, keys), in insertion order
+        self._products = OrderedDict()
+
+    def _keys_for(self, title):
+        words = normalize_title(title).split(' ')
+        return {
+            ' '.join(words[position:])[:self.max_key_length]
+            for position in range(min(len(words), self.max_words))
+            if words[position]
+        }
+
+    @property
+    def is_built(self):
+        if self._built_at is None or time.monotonic() - self._built_at >= self.max_age:
+            return False
+        return self._invalidated_at is None or self._built_at > self._invalidated_at
+
+    def refresh(self, load_rows):
+        """Make sure the index is fresh, `load_rows` returns the rows for build().
+
+        Waits for the first build; when the index is only stale, starts a
+        background rebuild unless one is already running and returns at once.
+        """
+        if self.is_built:
+            return
+        if self._built_at is not None:
+            if self._build_lock.acquire(blocking=False):
+                threading.Thread(target=self._rebuild, args=(load_rows,), daemon=True).start()
+            return
+        with self._build_lock:
+            if self._built_at is None:
+                self._load(load_rows)
+
+    def _rebuild(self, load_rows):
+        try:
+            self._load(load_rows)
+        except Exception:
+            logger.exception('Rebuilding the autocomplete index failed')
+        finally:
+            self._build_lock.release()
+
+    def _load(self, load_rows):
+        # Writes committed after the rows are read must leave the index stale
+        started = time.monotonic()
+        self.build(load_rows(), built_at=started)
+
+    def build(self, rows, built_at=None):
+        """Rebuild from (id, title, category_id) rows, oldest first"""
+        products = OrderedDict()
+        for product_id, title, category_id in rows:
+            products[product_id] = (title, category_id, self._keys_for(title))
+            if len(products) > self.max_entries:
+                products.popitem(last=False)
+
+        keys = []
+        keys_by_category = {}
+        for product_id, (title, category_id, product_keys) in products.items():
+            entries = [(key, product_id) for key in product_keys]
+            keys.extend(entries)
+            keys_by_category.setdefault(category_id, []).extend(entries)
+        keys.sort()
+        for entries in keys_by_category.values():
+            entries.sort()
+
+        with self._lock:
+            self._products = products
+            self._keys = keys
+            self._keys_by_category = keys_by_category
+            self._built_at = time.monotonic() if built_at is None else built_at
+
+    def invalidate(self):
+        """Rebuild on the next search, cheaper than many add() calls after bulk writes"""
+        with self._lock:
+            self._invalidated_at = time.monotonic()
+
+    def add(self, product_id, title, category_id):
+        """Index a new or changed product; a no-op until the index is built"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(product_id)
+            product_keys = self._keys_for(title)
+            self._products[product_id] = (title, category_id, product_keys)
+            category_keys = self._keys_by_category.setdefault(category_id, [])
+            for key in product_keys:
+                insort(self._keys, (key, product_id))
+                insort(category_keys, (key, product_id))
+            if len(self._products) > self.max_entries:
+                self._remove(next(iter(self._products)))
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        _, category_id, product_keys = entry
+        for keys in (self._keys, self._keys_by_category.get(category_id, [])):
+            for key in product_keys:
+                position = bisect_left(keys, (key, product_id))
+                if position < len(keys) and keys[position] == (key, product_id):
+                    del keys[position]
+
+    def search(self, prefix, category_id=None, limit=10):
+        """Return up to `limit` (id, title) suggestions whose words start with `prefix`"""
+        prefix = normalize_title(prefix)[:self.max_key_length]
+        if not prefix:
+            return []
+        suggestions = []
+        seen = set()
+        with self._lock:
+            keys = self._keys if category_id is None else self._keys_by_category.get(category_id, [])
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and len(suggestions) < limit:
+                key, product_id = keys[position]
+                if not key.startswith(prefix):
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    suggestions.append((product_id, self._products[product_id][0]))
+                position += 1
+        return suggestions
+
+    def stats(self):
+        return {
+            'products': len(self._products),
+            'keys': len(self._keys),
+            'max_entries': self.max_entries,
+            'built': self.is_built,
+        }
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class MemoryBackend:
+    """Local stand-in for a shared backend, with the same Redis-like interface.
+
+    Only shared between threads of one process, which makes it useful for
+    tests and single-worker setups.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._values[key] = (value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires_at = self._values.get(key, (0, None))
+            value = int(value) + 1
+            self._values[key] = (value, expires_at)
+            return value
+
+
+class RedisBackend:
+    """Shared backend for any Redis-compatible server"""
+
+    def __init__(self, url):
+        # Optional dependency, only needed when a redis:// URL is configured
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def make_backend(url):
+    """Build a shared backend from a URL: redis://..., memory:// or nothing"""
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    return RedisBackend(url)
+
+
+class VersionedCache:
+    """Two-level cache whose keys embed a version counter.
+
+    Bumping the version invalidates every entry at once: old keys are never
+    looked up again and age out of the LRU. With a shared backend the counter
+    lives in the backend, so a bump in one worker is seen by all of them;
+    without one, other workers serve stale entries for at most the TTL.
+    Values stored in a shared backend must be bytes.
+    """
+
+    def __init__(self, namespace, local, backend=None):
+        self.namespace = namespace
+        self.local = local
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        if self.backend is None:
+            return self._version
+        return int(self.backend.get(f'{self.namespace}:version') or 0)
+
+    def bump(self):
+        """Invalidate every cached entry"""
+        if self.backend is not None:
+            self.backend.incr(f'{self.namespace}:version')
+        else:
+            with self._lock:
+                self._version += 1
+        self.local.clear()
+
+    def _full_key(self, key, version=None):
+        if version is None:
+            version = self.version()
+        return f'{self.namespace}:{version}:{key}'
+
+    def get(self, key, version=None):
+        full_key = self._full_key(key, version)
+        value = self.local.get(full_key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(full_key)
+            if value is not None:
+                self.local.set(full_key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, version=None):
+        """Store `value` under `version`.
+
+        Pass the version read before loading the value: if a write bumped it
+        in between, the possibly stale value lands under a key that is never
+        looked up again.
+        """
+        full_key = self._full_key(key, version)
+        self.local.set(full_key, value)
+        if self.backend is not None:
+            self.backend.set(full_key, value, ttl=self.local.ttl)
+
+    def stats(self):
+        return {
+            'version': self.version(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'local': self.local.stats(),
+            'backend': type(self.backend).__name__ if self.backend else None,
+        }
+
+
+cache_backend = make_backend(os.getenv('CACHE_BACKEND_URL'))
+
+# Product listing responses, invalidated by any catalog write
+catalog_cache = VersionedCache(
+    'catalog',
+    TTLCache(
+        max_size=int(os.getenv('CATALOG_CACHE_SIZE', 1024)),
+        ttl=int(os.getenv('CATALOG_CACHE_TTL', 60))
+    ),
+    cache_backend
+)
+
+# Serialized category list with product counts, invalidated when categories
+# or products are created or deleted
+category_cache = VersionedCache(
+    'categories',
+    TTLCache(max_size=1, ttl=int(os.getenv('CATEGORY_CACHE_TTL', 300))),
+    cache_backend
+)
@@ -0,0 +1,115 @@
+import threading
+import time
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import ConfirmationCode
+from app.utils.cache import make_backend
+
+
+class MemoryCodeStore:
+    """Per-process store, only correct with a single worker.
+
+    Expired entries are swept on writes, at most every `sweep_interval`
+    seconds, so codes that are never verified don't accumulate.
+    """
+
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._swept_at = time.time()
+
+    def set(self, email, code, expires_at):
+        with self._lock:
+            self._codes[email] = (code, expires_at)
+            now = time.time()
+            if now - self._swept_at >= self.sweep_interval:
+                self._codes = {k: v for k, v in self._codes.items() if v[1] > now}
+                self._swept_at = now
+
+    def get(self, email):
+        return self._codes.get(email)
+
+    def delete(self, email):
+        with self._lock:
+            self._codes.pop(email, None)
+
+
+class BackendCodeStore:
+    """Store on a Redis-like backend, which expires entries by itself"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def set(self, email, code, expires_at):
+        ttl = max(int(expires_at - time.time()) + 1, 1)
+        self.backend.set(f'confirmation_code:{email}', f'{code}:{expires_at}'.encode(), ttl=ttl)
+
+    def get(self, email):
+        value = self.backend.get(f'confirmation_code:{email}')
+        if value is None:
+            return None
+        code, expires_at = value.decode().split(':')
+        return code, float(expires_at)
+
+    def delete(self, email):
+        self.backend.delete(f'confirmation_code:{email}')
+
+
+class DatabaseCodeStore:
+    """Store in the confirmation_code table, shared by every worker.
+
+    Uses its own connection so storing a code never commits or rolls back
+    the request's session.
+    """
+
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._swept_at = 0
+
+    def _upsert(self, dialect_name):
+        if dialect_name == 'postgresql':
+            return postgresql.insert(ConfirmationCode)
+        if dialect_name == 'sqlite':
+            return sqlite.insert(ConfirmationCode)
+        return None
+
+    def set(self, email, code, expires_at):
+        table = ConfirmationCode.__table__
+        with db.engine.begin() as connection:
+            insert = self._upsert(connection.dialect.name)
+            if insert is not None:
+                connection.execute(insert.values(email=email, code=code, expires_at=expires_at).on_conflict_do_update(
+                    index_elements=[table.c.email],
+                    set_={'code': code, 'expires_at': expires_at}
+                ))
+            else:
+                connection.execute(table.delete().where(table.c.email == email))
+                connection.execute(table.insert().values(email=email, code=code, expires_at=expires_at))
+
+            now = time.time()
+            if now - self._swept_at >= self.sweep_interval:
+                connection.execute(table.delete().where(table.c.expires_at < now))
+                self._swept_at = now
+
+    def get(self, email):
+        table = ConfirmationCode.__table__
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                db.select(table.c.code, table.c.expires_at).where(table.c.email == email)
+            ).first()
+        return tuple(row) if row else None
+
+    def delete(self, email):
+        table = ConfirmationCode.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.email == email))
+
+
+def make_code_store(kind):
+    """Build a code store: 'database', 'memory', or a shared backend URL (redis://, memory://)"""
+    if kind == 'database':
+        return DatabaseCodeStore()
+    if kind == 'memory':
+        return MemoryCodeStore()
+    return BackendCodeStore(make_backend(kind))
@@ -0,0 +1,163 @@
+import hashlib
+import zlib
+from flask import request
+from app.utils.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it only gzip is offered
+    brotli = None
+
+# Text formats the API sends; images and other binary files are already compressed
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/html',
+    'text/plain',
+}
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compressor:
+    """Compresses text responses in an after_request hook.
+
+    The encoding is negotiated from Accept-Encoding (q-values included),
+    preferring brotli when it is installed. Bodies under `min_size` bytes are
+    sent as they are. Compressed bodies are cached by (ETag or body hash,
+    encoding), so cached listings and category snapshots are compressed once
+    rather than on every hit; compressing changes the bytes, so a strong ETag
+    is sent weak and still answers If-None-Match. Streamed responses are
+    compressed chunk by chunk and flushed after each one, so exports keep
+    arriving progressively.
+    """
+
+    def __init__(self, min_size=500, level=6, brotli_quality=5, cache_size=256):
+        self.enabled = True
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.cache = TTLCache(max_size=cache_size, ttl=300)
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESSION_ENABLED', self.enabled)
+        self.min_size = app.config.get('COMPRESSION_MIN_SIZE', self.min_size)
+        self.level = app.config.get('COMPRESSION_LEVEL', self.level)
+        self.brotli_quality = app.config.get('COMPRESSION_BROTLI_QUALITY', self.brotli_quality)
+        self.cache.max_size = app.config.get('COMPRESSION_CACHE_SIZE', self.cache.max_size)
+        if self.enabled:
+            app.after_request(self.after_request)
+
+    @property
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def stream(self, encoding):
+        if encoding == 'br':
+            return BrotliStream(self.brotli_quality)
+        return GzipStream(self.level)
+
+    def compress(self, data, encoding):
+        stream = self.stream(encoding)
+        return stream.compress(data) + stream.finish()
+
+    def after_request(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        if not response.is_streamed and (response.content_length or 0) < self.min_size:
+            return response
+
+        # Shared caches must keep compressed and plain copies apart
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(self.compress_body(response, encoding))
+        response.headers['Content-Encoding'] = encoding
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def compress_body(self, response, encoding):
+        body = response.get_data()
+        etag, _ = response.get_etag()
+        if etag:
+            key = (request.path, etag, encoding)
+        else:
+            key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            self.cache.set(key, compressed)
+            self.compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+        return compressed
+
+    def compress_stream(self, chunks, encoding):
+        stream = self.stream(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                data = stream.compress(chunk) + stream.flush()
+                if data:
+                    yield data
+            yield stream.finish()
+        finally:
+            # Let the wrapped iterable release what it holds, e.g. a database cursor
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def stats(self):
+        return {
+            'encodings': list(self.encodings),
+            'compressed': self.compressed,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'cache': self.cache.stats(),
+        }
+
+
+compressor = Compressor()
@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class CredentialService:
+    """Password hashing and verification on a bounded thread pool.
+
+    hashlib releases the GIL while hashing, so the pool lets hashes from
+    concurrent requests run in parallel while capping how many CPU-heavy
+    hashes one worker process runs at a time. The pool is created on first
+    use, after gunicorn has forked.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', max_workers=2):
+        self.method = method
+        self.max_workers = max_workers
+        self._executor = None
+        self._prefix = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.max_workers = app.config.get('PASSWORD_HASH_WORKERS', self.max_workers)
+        self._prefix = None
+
+    def _run(self, function, *args, **kwargs):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='credentials')
+        return self._executor.submit(function, *args, **kwargs).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other parameters than the configured ones"""
+        if self._prefix is None:
+            # Werkzeug fills in default parameters (e.g. the iteration count),
+            # so compare against the prefix it actually writes
+            self._prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
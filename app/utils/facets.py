@@ -0,0 +1,94 @@
+from collections import Counter
+from app import db
+from app.models import Product
+
+# Lower bounds of the price buckets, the last one is open-ended
+PRICE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000)
+# Lower bounds of the rating buckets, 5.0 falls into the last one
+RATING_BUCKETS = (0, 1, 2, 3, 4)
+RATING_MAX = 5
+
+FACETS = ('category', 'price', 'rating')
+
+
+def parse_facets(value):
+    """Requested facet names in canonical order, unknown names are ignored"""
+    requested = {name.strip() for name in (value or '').split(',')}
+    return [name for name in FACETS if name in requested]
+
+
+def range_value(lower, upper=None):
+    """A 'min,max' filter value, 'min,' when there is no upper bound"""
+    return f'{float(lower)},{float(upper) if upper is not None else ""}'
+
+
+def bucket_bounds(bounds, index, upper_limit=None):
+    """The bucket's min and max, plus the price_bucket/rating_bucket value selecting exactly its products.
+
+    Buckets include their min and exclude their max, unlike the listing's
+    range filters which include both; max is None for an open-ended last
+    bucket.
+    """
+    upper = bounds[index + 1] if index + 1 < len(bounds) else upper_limit
+    return {
+        'min': float(bounds[index]),
+        'max': float(upper) if upper is not None else None,
+        'bucket': range_value(bounds[index], upper),
+    }
+
+
+def at_least(column, bound):
+    return db.func.sum(db.case((column >= bound, 1), else_=0))
+
+
+def bucket_counts(totals, at_least_counts):
+    """Per-bucket counts from how many rows reach each bucket's lower bound"""
+    cumulative = [totals] + at_least_counts
+    return [cumulative[index] - (cumulative[index + 1] if index + 1 < len(cumulative) else 0)
+            for index in range(len(cumulative))]
+
+
+def count_facets(query, names):
+    """Counts for every requested facet from one query grouped by category.
+
+    `query` is a product query with the listing filters applied. Each row
+    holds a category's total plus how many of its products reach every
+    bucket's lower bound, so no per-row bucket expression has to be grouped
+    on; bucket counts are the differences between neighbouring bounds.
+    """
+    price_bounds = PRICE_BUCKETS[1:] if 'price' in names else ()
+    rating_bounds = RATING_BUCKETS[1:] if 'rating' in names else ()
+    rows = query.with_entities(
+        Product.category_id,
+        db.func.count(),
+        *[at_least(Product.price, bound) for bound in price_bounds],
+        *[at_least(Product.overall_rating, bound) for bound in rating_bounds]
+    ).group_by(Product.category_id).all()
+
+    categories = Counter()
+    prices = [0] * (len(price_bounds) + 1)
+    ratings = [0] * (len(rating_bounds) + 1)
+    for category_id, total, *reached in rows:
+        categories[category_id] += total
+        for index, count in enumerate(bucket_counts(total, [int(n or 0) for n in reached[:len(price_bounds)]])):
+            prices[index] += count
+        for index, count in enumerate(bucket_counts(total, [int(n or 0) for n in reached[len(price_bounds):]])):
+            ratings[index] += count
+
+    facets = {}
+    if 'category' in names:
+        facets['category'] = [
+            {'category_id': category_id, 'count': count}
+            for category_id, count in sorted(categories.items(), key=lambda item: (-item[1], item[0]))
+        ]
+    if 'price' in names:
+        facets['price'] = [
+            {**bucket_bounds(PRICE_BUCKETS, index), 'count': count}
+            for index, count in enumerate(prices) if count
+        ]
+    if 'rating' in names:
+        facets['rating'] = [
+            {**bucket_bounds(RATING_BUCKETS, index, upper_limit=RATING_MAX), 'count': count}
+            for index, count in enumerate(ratings) if count
+        ]
+    return facets
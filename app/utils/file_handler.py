@@ -1,12 +1,36 @@
 import os
+import hashlib
+import tempfile
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from datetime import datetime
-import imghdr
+
+# Read uploads in chunks so large files are never held in memory
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of every accepted image format and the extension it's stored with
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+def detect_image_type(head):
+    """Extension for the image format `head` starts with, None if it isn't one"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
 
 class FileHandler:
-    def __init__(self, upload_folder):
+    def __init__(self, upload_folder, content_addressed=False, before_store=None):
         self.upload_folder = upload_folder
         self.allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
+        # Store uploads under their sha256 so identical images are kept once
+        self.content_addressed = content_addressed
+        # Called with the relative path right before a file is moved into place
+        self.before_store = before_store
 
     def allowed_file(self, file):
         # Check file extension and mime type
@@ -18,6 +42,9 @@ class FileHandler:
 
     def save_file(self, file, subfolder='products'):
         if file and self.allowed_file(file):
+            if self.content_addressed:
+                return self.save_content_addressed(file, subfolder)
+
             # Create unique filename
             filename = secure_filename(file.filename)
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -28,17 +55,58 @@ class FileHandler:
             os.makedirs(folder_path, exist_ok=True)
             
             # Save file
-            file_path = os.path.join(folder_path, unique_filename)
-            file.save(file_path)
+            relative_path = os.path.join(subfolder, unique_filename)
+            if self.before_store:
+                self.before_store(relative_path)
+            file.save(os.path.join(self.upload_folder, relative_path))
             
             # Return relative path for database storage
-            return os.path.join(subfolder, unique_filename)
+            return relative_path
         return None
 
+    def save_content_addressed(self, file, subfolder='products'):
+        """Stream the upload to disk while hashing it, stored as subfolder/ab/cd/<sha256>.<ext>.
+
+        The format is taken from the magic bytes of the first chunk, not the
+        filename. Returns None if the upload isn't a supported image.
+        """
+        head = file.stream.read(CHUNK_SIZE)
+        extension = detect_image_type(head)
+        if not extension:
+            return None
+
+        folder_path = os.path.join(self.upload_folder, subfolder)
+        os.makedirs(folder_path, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=folder_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                chunk = head
+                while chunk:
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    chunk = file.stream.read(CHUNK_SIZE)
+
+            name = digest.hexdigest()
+            relative_path = os.path.join(subfolder, name[:2], name[2:4], f'{name}.{extension}')
+            full_path = os.path.join(self.upload_folder, relative_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.before_store:
+                self.before_store(relative_path)
+            # Identical content may already be stored; replacing it is harmless
+            # and atomic, so readers never see a partial file
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return relative_path
+
     def delete_file(self, file_path):
         if file_path:
-            full_path = os.path.join(self.upload_folder, file_path)
-            if os.path.exists(full_path):
+            # Paths come from the database; never follow one out of the upload folder
+            full_path = safe_join(self.upload_folder, file_path)
+            if full_path and os.path.exists(full_path):
                 os.remove(full_path)
                 return True
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from app import db
+from app.models import User
+from app.utils.cache import TTLCache, cache_backend
+
+# The user fields routes read on almost every request
+IDENTITY_FIELDS = ('id', 'role', 'username', 'email')
+
+
+class CachedIdentity:
+    """Lightweight stand-in for User, built from cached identity fields.
+
+    Any other attribute (full_name, address, ...) loads the full User row on
+    first access, so routes that need more than the identity keep working.
+    """
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, role, username, email):
+        self.id = id
+        self.role = role
+        self.username = username
+        self.email = email
+
+    def get_id(self):
+        return str(self.id)
+
+    def is_seller(self):
+        return self.role == 'seller'
+
+    def is_buyer(self):
+        return self.role == 'buyer'
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def __getattr__(self, name):
+        user = self.__dict__.get('_user')
+        if user is None:
+            user = db.session.get(User, self.id)
+            if user is None:
+                raise AttributeError(name)
+            self.__dict__['_user'] = user
+        return getattr(user, name)
+
+
+class IdentityCache:
+    """Two-level TTL'd cache of user identities for the Flask-Login user_loader.
+
+    Must be invalidated whenever a user's identity fields change or the user
+    is deleted. Keys embed a per-user generation that invalidate() bumps, so
+    the old entry is never looked up again. With a shared backend the
+    generations live in it and every lookup checks the current one, so an
+    invalidation in one worker takes effect in all of them at once. Without
+    one other workers keep serving their copy until it expires, so keep the
+    TTL short in multi-worker setups.
+    """
+
+    def __init__(self, local, backend=None):
+        self.local = local
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, user_id):
+        """Counter bumped by every invalidation of the user"""
+        if self.backend is None:
+            return self._generations.get(user_id, 0)
+        return int(self.backend.get(f'identity:generation:{user_id}') or 0)
+
+    def _key(self, user_id, generation):
+        return f'identity:{user_id}:{generation}'
+
+    def load(self, user_id):
+        """Return a CachedIdentity for the user, or None if it doesn't exist"""
+        # Read before the database, so fields loaded before an invalidation
+        # are stored under a key that is never looked up again
+        key = self._key(user_id, self.generation(user_id))
+        fields = self.local.get(key)
+        if fields is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                fields = json.loads(value)
+                self.local.set(key, fields)
+
+        if fields is None:
+            self.misses += 1
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            fields = {field: getattr(user, field) for field in IDENTITY_FIELDS}
+            self.local.set(key, fields)
+            if self.backend is not None:
+                self.backend.set(key, json.dumps(fields).encode(), ttl=self.local.ttl)
+        else:
+            self.hits += 1
+        return CachedIdentity(**fields)
+
+    def invalidate(self, user_id):
+        if self.backend is not None:
+            self.backend.incr(f'identity:generation:{user_id}')
+        else:
+            with self._lock:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'local': self.local.stats(),
+            'backend': type(self.backend).__name__ if self.backend else None,
+        }
+
+
+identity_cache = IdentityCache(
+    TTLCache(
+        max_size=int(os.getenv('IDENTITY_CACHE_SIZE', 10000)),
+        ttl=int(os.getenv('IDENTITY_CACHE_TTL', 30))
+    ),
+    cache_backend
+)
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, without it only originals are served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each derivative
+VARIANTS = {'thumbnail': 160, 'card': 480, 'full': 1280}
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+VARIANT_PATTERN = re.compile(r'^(?:(.*)/)?variants/(.+)__(%s)\.(%s)$' % ('|'.join(VARIANTS), '|'.join(FORMATS)))
+
+
+def variant_path(path, variant, fmt):
+    """products/x.png -> products/variants/x.png__card.webp"""
+    folder, filename = os.path.split(path)
+    return os.path.join(folder, 'variants', f'{filename}__{variant}.{fmt}')
+
+
+def original_path(path):
+    """Inverse of variant_path, None if `path` isn't a variant"""
+    match = VARIANT_PATTERN.match(path)
+    if not match:
+        return None
+    folder, filename = match.group(1), match.group(2)
+    return os.path.join(folder, filename) if folder else filename
+
+
+def generate_variants(upload_folder, path, fmt='webp', quality=80):
+    """Write every variant of an uploaded image; runs in a worker process"""
+    with Image.open(os.path.join(upload_folder, path)) as image:
+        image = ImageOps.exif_transpose(image)
+        if fmt == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if fmt == 'jpeg' else 'RGBA')
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            target = os.path.join(upload_folder, variant_path(path, variant, fmt))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Write under a temporary name so readers never see partial files
+            resized.save(target + '.tmp', FORMATS[fmt], quality=quality)
+            os.replace(target + '.tmp', target)
+    return path
+
+
+class ImagePipeline:
+    """Generates resized WebP/JPEG derivatives of uploaded product images.
+
+    Work runs on a process pool created on first use, so uploads return as
+    soon as the original is stored. Until a variant exists get_image serves
+    the original in its place.
+    """
+
+    def __init__(self, upload_folder, fmt='webp', workers=2, quality=80):
+        self.upload_folder = upload_folder
+        self.fmt = fmt
+        self.workers = workers
+        self.quality = quality
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None and self.workers > 0
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Spawned rather than forked: the web process runs threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def submit(self, path):
+        if not self.enabled:
+            return None
+        future = self._pool().submit(generate_variants, self.upload_folder, path, self.fmt, self.quality)
+        # Nobody waits on uploads' futures; a file Pillow can't decode would fail silently
+        future.add_done_callback(lambda future: self._log_failure(path, future))
+        return future
+
+    def _log_failure(self, path, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error('Generating image variants for %s failed', path, exc_info=error)
+
+    def map(self, paths):
+        """Generate variants for many images, yielding each path or its exception"""
+        futures = [self.submit(path) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                yield path, future.result()
+            except Exception as e:
+                yield path, e
+
+    def variants(self, path):
+        return {variant: variant_path(path, variant, self.fmt) for variant in VARIANTS}
+
+    def variants_for(self, paths):
+        """Variant paths for a product's image list, parallel to it"""
+        return [self.variants(path) for path in paths or []]
+
+    def has_variants(self, path):
+        return all(
+            os.path.exists(os.path.join(self.upload_folder, variant))
+            for variant in self.variants(path).values()
+        )
+
+    def delete_variants(self, path):
+        for variant in self.variants(path).values():
+            full_path = safe_join(self.upload_folder, variant)
+            if full_path and os.path.exists(full_path):
+                os.remove(full_path)
+
+
+image_pipeline = ImagePipeline(
+    os.getenv('UPLOADS_FOLDER'),
+    fmt=os.getenv('IMAGE_VARIANT_FORMAT', 'webp'),
+    workers=int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+)
@@ -0,0 +1,41 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, without it Flask's stdlib provider is used
+    orjson = None
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with orjson.
+
+    Output matches the default provider's: keys sorted when sort_keys is set,
+    dates as HTTP dates and other types through the same `default` hook,
+    compact unless in debug mode. Calls passing stdlib json options fall back
+    to the default provider.
+    """
+
+    def options(self, indent=False):
+        # Datetimes go through `default` so they keep Flask's HTTP date format
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self.options(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
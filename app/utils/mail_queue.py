@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+    """Sends mail from background threads instead of the request thread.
+
+    Worker threads are started on first use, so each gunicorn worker starts
+    its own after forking. A worker drains the queue in batches over an SMTP
+    connection it keeps open until `idle_timeout` seconds pass without mail.
+    A failed send drops the connection and is retried on a fresh one after
+    `backoff * 2 ** attempt` seconds, up to `max_retries` times. With zero
+    workers messages are sent synchronously, as before.
+    """
+
+    def __init__(self, mail, workers=2, batch_size=20, max_retries=3, backoff=1.0, idle_timeout=30):
+        self.mail = mail
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.app = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('MAIL_QUEUE_WORKERS', self.workers)
+
+    def send(self, message):
+        if not self.workers:
+            self.mail.send(message)
+            return
+        self._ensure_started()
+        self._queue.put((message, 0))
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'mail-queue-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        connection = None
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                connection = self._close(connection)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self.app.app_context():
+                for message, attempt in batch:
+                    try:
+                        if connection is None:
+                            connection = self.mail.connect()
+                            connection.__enter__()
+                        started = time.perf_counter()
+                        connection.send(message)
+                        self._record_send(time.perf_counter() - started)
+                    except Exception:
+                        connection = self._close(connection)
+                        self._retry(message, attempt)
+                    finally:
+                        self._queue.task_done()
+
+    def _record_send(self, seconds):
+        self.sent += 1
+        self.send_seconds_total += seconds
+        self.send_seconds_max = max(self.send_seconds_max, seconds)
+
+    def _retry(self, message, attempt):
+        if attempt >= self.max_retries:
+            self.failed += 1
+            logger.exception('Giving up on mail to %s after %d attempts', message.recipients, attempt + 1)
+            return
+        self.retried += 1
+        logger.warning('Sending mail to %s failed, retrying', message.recipients)
+        timer = threading.Timer(self.backoff * 2 ** attempt, self._queue.put, [(message, attempt + 1)])
+        timer.daemon = True
+        timer.start()
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'send_seconds_avg': self.send_seconds_total / self.sent if self.sent else 0.0,
+            'send_seconds_max': self.send_seconds_max,
+        }
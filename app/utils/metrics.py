@@ -0,0 +1,289 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Literals and placeholders collapse to ?, so every run of a statement looks the same
+NORMALIZE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|:\w+\b|\$\d+'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize_statement(statement, max_length=500):
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()[:max_length]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def add(self, counts, total):
+        for index, count in enumerate(counts):
+            self.counts[index] += count
+        self.sum += total
+
+    def samples(self):
+        """(le, cumulative count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestTimer:
+    __slots__ = ('started', 'queries', 'sql_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+def series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+class Metrics:
+    """Per-endpoint request metrics, collected in request hooks and engine events.
+
+    Records request latency and response size histograms, request counts by
+    status, and how many SQL statements each endpoint ran and for how long.
+    Statements slower than `slow_query_ms` are logged in normalized form.
+    Everything is rendered in the Prometheus text format. When disabled no
+    hooks or listeners are registered, so requests pay nothing for it.
+
+    Each process keeps its own totals. With several gunicorn workers, set
+    `directory` to a folder they share: every worker writes its totals there
+    at most every `flush_interval` seconds, and render() adds up all files.
+    Files of exited workers are kept, so totals never go backwards; the
+    folder is emptied on deploy. Without a directory a scrape only sees the
+    worker that served it, which is only right with a single worker.
+    """
+
+    def __init__(self, slow_query_ms=100, server_timing=True, directory=None, flush_interval=5):
+        self.enabled = False
+        self.slow_query_ms = slow_query_ms
+        self.server_timing = server_timing
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flushed_at = 0.0
+        self.latency = {}
+        self.sizes = {}
+        self.requests = {}
+        self.sql_queries = {}
+        self.sql_seconds = {}
+        self.statements = Histogram(LATENCY_BUCKETS)
+        self.slow_queries = 0
+        self._current = ContextVar('request_timer', default=None)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.slow_query_ms = app.config.get('METRICS_SLOW_QUERY_MS', self.slow_query_ms)
+        self.server_timing = app.config.get('METRICS_SERVER_TIMING', self.server_timing)
+        self.directory = app.config.get('METRICS_DIR', self.directory)
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', self.flush_interval)
+        if not self.enabled:
+            return
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_request(self):
+        request.environ['metrics.token'] = self._current.set(RequestTimer())
+
+    def after_request(self, response):
+        timer = self._current.get()
+        if timer is None:
+            return response
+        elapsed = time.perf_counter() - timer.started
+        endpoint = request.endpoint or 'unmatched'
+        key = (endpoint, request.method)
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.sizes[key] = Histogram(SIZE_BUCKETS)
+                self.sql_queries[key] = 0
+                self.sql_seconds[key] = 0.0
+            self.latency[key].observe(elapsed)
+            # Streamed bodies have no length up front
+            if response.content_length is not None:
+                self.sizes[key].observe(response.content_length)
+            self.sql_queries[key] += timer.queries
+            self.sql_seconds[key] += timer.sql_seconds
+            status_key = key + (response.status_code,)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+        if self.server_timing:
+            response.headers.add(
+                'Server-Timing',
+                f'app;dur={elapsed * 1000:.1f}, db;dur={timer.sql_seconds * 1000:.1f};desc="{timer.queries} queries"'
+            )
+        return response
+
+    def teardown_request(self, exc):
+        token = request.environ.pop('metrics.token', None)
+        if token is not None:
+            self._current.reset(token)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        timer = self._current.get()
+        if timer is not None:
+            timer.queries += 1
+            timer.sql_seconds += elapsed
+        with self._lock:
+            self.statements.observe(elapsed)
+        if elapsed * 1000 >= self.slow_query_ms:
+            self.slow_queries += 1
+            logger.warning(
+                'Slow query (%.1f ms) in %s: %s',
+                elapsed * 1000, request.endpoint if timer is not None else '-', normalize_statement(statement)
+            )
+
+    def snapshot(self):
+        """This process's totals as plain JSON-serializable data"""
+        with self._lock:
+            return {
+                'endpoints': [[
+                    *key,
+                    list(self.latency[key].counts), self.latency[key].sum,
+                    list(self.sizes[key].counts), self.sizes[key].sum,
+                    self.sql_queries[key], self.sql_seconds[key],
+                ] for key in self.latency],
+                'requests': [[*key, count] for key, count in self.requests.items()],
+                'statements': [list(self.statements.counts), self.statements.sum],
+                'slow_queries': self.slow_queries,
+            }
+
+    def add(self, snapshot):
+        """Add a snapshot's totals to this instance's"""
+        with self._lock:
+            for endpoint, method, latency, latency_sum, sizes, sizes_sum, queries, seconds in snapshot['endpoints']:
+                key = (endpoint, method)
+                if key not in self.latency:
+                    self.latency[key] = Histogram(LATENCY_BUCKETS)
+                    self.sizes[key] = Histogram(SIZE_BUCKETS)
+                    self.sql_queries[key] = 0
+                    self.sql_seconds[key] = 0.0
+                self.latency[key].add(latency, latency_sum)
+                self.sizes[key].add(sizes, sizes_sum)
+                self.sql_queries[key] += queries
+                self.sql_seconds[key] += seconds
+            for endpoint, method, status, count in snapshot['requests']:
+                key = (endpoint, method, status)
+                self.requests[key] = self.requests.get(key, 0) + count
+            self.statements.add(*snapshot['statements'])
+            self.slow_queries += snapshot['slow_queries']
+
+    def flush(self):
+        """Write this process's totals to the shared directory"""
+        if not self._flushed_at:
+            # Only processes that served requests leave a file, not CLI commands
+            atexit.register(self.flush)
+        self._flushed_at = time.monotonic()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, os.path.join(self.directory, f'metrics-{os.getpid()}.json'))
+
+    def totals(self):
+        """Totals of every worker writing to the shared directory, or of this process"""
+        if not self.directory:
+            return self
+        self.flush()
+        totals = Metrics()
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    totals.add(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced or half written by a dying worker
+                continue
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        return self.totals().format()
+
+    def format(self):
+        lines = []
+
+        def histogram(name, description, histograms):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, values in histograms:
+                for bound, count in values.samples():
+                    lines.append(f'{series(name + "_bucket", labels + (("le", bound),))} {count}')
+                lines.append(f'{series(name + "_sum", labels)} {values.sum}')
+                lines.append(f'{series(name + "_count", labels)} {sum(values.counts)}')
+
+        def counter(name, description, values):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in values:
+                lines.append(f'{series(name, labels)} {value}')
+
+        with self._lock:
+            keys = sorted(self.latency)
+            endpoint_labels = {key: (('endpoint', key[0]), ('method', key[1])) for key in keys}
+            counter('http_requests_total', 'Requests by endpoint, method and status.', [
+                ((('endpoint', endpoint), ('method', method), ('status', status)), count)
+                for (endpoint, method, status), count in sorted(self.requests.items())
+            ])
+            histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                      [(endpoint_labels[key], self.latency[key]) for key in keys])
+            histogram('http_response_size_bytes', 'Response body size by endpoint, streamed bodies excluded.',
+                      [(endpoint_labels[key], self.sizes[key]) for key in keys])
+            counter('db_queries_total', 'SQL statements run by each endpoint.',
+                    [(endpoint_labels[key], self.sql_queries[key]) for key in keys])
+            counter('db_query_duration_seconds_total', 'Time spent in SQL statements by each endpoint.',
+                    [(endpoint_labels[key], round(self.sql_seconds[key], 6)) for key in keys])
+            histogram('db_statement_duration_seconds', 'Duration of every SQL statement.', [((), self.statements)])
+            counter('db_slow_queries_total', 'SQL statements slower than the slow query threshold.',
+                    [((), self.slow_queries)])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,27 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order_by, sort_value, last_id):
+    """Encode the sort key of the last row on a page into an opaque token"""
+    payload = json.dumps([order_by, sort_value, last_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, order_by):
+    """Decode a cursor token back into (sort_value, last_id)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor_order_by, sort_value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    # A cursor is only meaningful for the ordering it was issued for
+    if cursor_order_by != order_by or not isinstance(last_id, int):
+        raise InvalidCursor("Cursor does not match the requested ordering")
+    if not isinstance(sort_value, (int, float)):
+        raise InvalidCursor("Invalid cursor")
+    return sort_value, last_id
@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+import math
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+from collections import Counter
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import FileStorage
+from app import db
+from app.models import Product, ImageBlob
+from app.utils.stats import record, product_deltas
+
+CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_SIZE = 16 * 1024 * 1024
+# Files a zip import reads its rows from, in order of preference
+MANIFESTS = {'products.ndjson': 'ndjson', 'products.csv': 'csv'}
+MIMETYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+}
+
+
+class InvalidImport(ValueError):
+    """The upload as a whole can't be imported"""
+
+
+def import_format(mimetype, filename=None, requested=None):
+    """csv, ndjson or zip from ?format=, the content type or the filename"""
+    if requested:
+        if requested not in ('csv', 'ndjson', 'zip'):
+            raise InvalidImport(f'Unsupported format: {requested}')
+        return requested
+    if mimetype in MIMETYPES:
+        return MIMETYPES[mimetype]
+    extension = os.path.splitext(filename or '')[1].lower()[1:]
+    if extension in ('csv', 'ndjson', 'zip'):
+        return extension
+    raise InvalidImport('Send text/csv, application/x-ndjson or application/zip, or pass ?format=')
+
+
+def read_csv(stream):
+    """Yield (row number, record) from a CSV byte stream; images are ';'-separated"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    for row_number, row in enumerate(csv.DictReader(text), start=1):
+        images = row.get('images')
+        row['images'] = [name for name in images.split(';') if name] if images else []
+        yield row_number, row
+
+
+def read_ndjson(stream):
+    """Yield (row number, record) from an NDJSON byte stream, records that don't parse become exceptions"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('Expected a JSON object')
+        except ValueError as e:
+            record = ValueError(f'Invalid JSON: {e}')
+        yield row_number, record
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+class ZipImport:
+    """A zip upload: a products.csv/products.ndjson manifest plus the images it names.
+
+    The body is spooled to a temporary file because zip archives can only be
+    read with seeking.
+    """
+
+    def __init__(self, stream):
+        self._file = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+        shutil.copyfileobj(stream, self._file, CHUNK_SIZE)
+        self._file.seek(0)
+        try:
+            self.archive = zipfile.ZipFile(self._file)
+        except zipfile.BadZipFile:
+            self.close()
+            raise InvalidImport('Invalid zip archive')
+
+        names = {posixpath.basename(name): name for name in self.archive.namelist()}
+        for manifest, fmt in MANIFESTS.items():
+            if manifest in names:
+                self.manifest = names[manifest]
+                self.format = fmt
+                break
+        else:
+            self.close()
+            raise InvalidImport(f'The archive needs one of: {", ".join(MANIFESTS)}')
+        self.folder = posixpath.dirname(self.manifest)
+
+    def records(self):
+        return READERS[self.format](self.archive.open(self.manifest))
+
+    def open_image(self, name):
+        """The named image as a FileStorage, paths are relative to the manifest"""
+        try:
+            info = self.archive.getinfo(posixpath.join(self.folder, name))
+        except KeyError:
+            raise ValueError(f'Image not found in archive: {name}')
+        if info.file_size > MAX_IMAGE_SIZE:
+            raise ValueError(f'Image too large: {name}')
+        return FileStorage(stream=self.archive.open(info), filename=posixpath.basename(name))
+
+    def close(self):
+        if getattr(self, 'archive', None):
+            self.archive.close()
+        self._file.close()
+
+
+class ProductImporter:
+    """Validates product records and inserts them in batches for one seller.
+
+    Each batch is a single executemany INSERT and its own commit, so a bad
+    row only costs its own error entry and a failing batch doesn't undo the
+    ones before it.
+    """
+
+    def __init__(self, user_id, category_ids, file_handler=None, batch_size=1000, max_errors=1000):
+        self.user_id = user_id
+        self.category_ids = category_ids
+        self.file_handler = file_handler
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.stored_images = []
+        self.failed_images = []
+        self._images_by_name = {}
+
+    def error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def validate(self, record, open_image=None):
+        """Column values for a record, raises ValueError with a message for the seller"""
+        if isinstance(record, Exception):
+            raise record
+        title = str(record.get('title') or '').strip()
+        if not title:
+            raise ValueError('Missing required field: title')
+        if len(title) > 200:
+            raise ValueError('Title is longer than 200 characters')
+        try:
+            price = float(record.get('price'))
+            stock = int(record.get('stock_quantity'))
+            if not math.isfinite(price) or price <= 0 or stock < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError('Invalid price or stock quantity')
+        try:
+            category_id = int(record.get('category_id'))
+        except (TypeError, ValueError):
+            category_id = None
+        if category_id not in self.category_ids:
+            raise ValueError('Invalid category')
+
+        names = record.get('images') or []
+        if not isinstance(names, list):
+            raise ValueError('images must be a list')
+        if names and open_image is None:
+            raise ValueError('Images can only be imported from a zip archive')
+        images = [self.store_image(name, open_image) for name in names]
+
+        return {
+            'title': title,
+            'description': str(record.get('description') or ''),
+            'price': price,
+            'stock_quantity': stock,
+            'category_id': category_id,
+            'images': images,
+            'user_id': self.user_id,
+        }
+
+    def store_image(self, name, open_image):
+        # Rows of one archive often share images, store each one once
+        if name not in self._images_by_name:
+            path = self.file_handler.save_file(open_image(name))
+            if not path:
+                raise ValueError(f'Unsupported image: {name}')
+            self._images_by_name[name] = path
+        return self._images_by_name[name]
+
+    def run(self, records, open_image=None):
+        batch = []
+        for row_number, row in records:
+            try:
+                batch.append((row_number, self.validate(row, open_image)))
+            except ValueError as e:
+                self.error(row_number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        return {
+            'imported': self.imported,
+            'failed': self.error_count,
+            'errors': self.errors,
+        }
+
+    def flush(self, batch):
+        rows = [values for _, values in batch]
+        # One reference per product using an image, like create_product
+        references = Counter(path for values in rows for path in set(values['images']))
+        images = list(references)
+        try:
+            db.session.execute(db.insert(Product), rows)
+            for path, count in references.items():
+                ImageBlob.retain([path], count)
+            record(*(product_deltas(values['category_id'], values['stock_quantity']) for values in rows))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            self.failed_images.extend(images)
+            for row_number, _ in batch:
+                self.error(row_number, f'Database error: {e.__class__.__name__}')
+            return
+        self.imported += len(rows)
+        self.stored_images.extend(images)
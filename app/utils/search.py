@@ -0,0 +1,112 @@
+"""Full-text search over product titles and descriptions.
+
+On Postgres this is a generated tsvector column with a GIN index; on SQLite
+(tests and local runs) an external-content FTS5 table kept in sync with the
+product table by triggers. Neither is part of the models, they are created
+by install_search_index (on create_all, or `flask install-search-index`).
+"""
+import re
+from sqlalchemy import event
+from app import db
+from app.models import Product
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_fts
+    USING fts5(title, description, content='product', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF title, description ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO product_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    # Index any rows that existed before the table was created
+    "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+]
+
+# Objects managed here rather than by the models
+SEARCH_OBJECTS = {'search_vector', 'ix_product_search_vector'}
+
+
+def install_search_index(connection):
+    """Create (idempotently) the search structures for the connection's database"""
+    if connection.dialect.name == 'postgresql':
+        statements = POSTGRES_DDL
+    elif connection.dialect.name == 'sqlite':
+        statements = SQLITE_DDL
+    else:
+        return False
+    for statement in statements:
+        connection.execute(db.text(statement))
+    return True
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep Alembic autogenerate from dropping the search structures"""
+    if type_ == 'table' and name.startswith('product_fts'):
+        return False
+    return name not in SEARCH_OBJECTS
+
+
+def search_terms(q):
+    """Split a user query into plain word tokens"""
+    return re.findall(r'\w+', q.lower())
+
+
+def search_products(query, q):
+    """Restrict a product query to full-text matches for `q`.
+
+    Returns the filtered query and an ORDER BY expression ranking the
+    matches by relevance, best first.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        ts_query = db.func.websearch_to_tsquery('english', q)
+        vector = db.literal_column('product.search_vector')
+        return query.filter(vector.op('@@')(ts_query)), db.func.ts_rank(vector, ts_query).desc()
+
+    if dialect == 'sqlite':
+        # Quote every token so user input can't use FTS5 query syntax
+        match = ' '.join(f'"{term}"' for term in search_terms(q))
+        matches = db.text(
+            "SELECT rowid AS id, bm25(product_fts, 10.0, 1.0) AS rank "
+            "FROM product_fts WHERE product_fts MATCH :match"
+        ).bindparams(match=match).columns(id=db.Integer, rank=db.Float).subquery('product_fts_match')
+        # bm25 scores are negative, lower is a better match
+        return query.join(matches, matches.c.id == Product.id), matches.c.rank.asc()
+
+    # No search index for other databases, fall back to substring matching
+    pattern = f'%{q}%'
+    query = query.filter(db.or_(Product.title.ilike(pattern), Product.description.ilike(pattern)))
+    return query, Product.created_at.desc()
+
+
+@event.listens_for(Product.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    install_search_index(connection)
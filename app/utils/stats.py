@@ -0,0 +1,105 @@
+from collections import Counter
+from app import db
+from app.models import StatCounter, User, Product, Review, Category
+
+# Counter keys:
+#   users, users:role:<role>
+#   products, products:category:<id>, stock, stock:category:<id>
+#   reviews, reviews:rating_sum
+
+
+def user_deltas(role, sign=1):
+    return {'users': sign, f'users:role:{role}': sign}
+
+
+def product_deltas(category_id, stock, sign=1):
+    return {
+        'products': sign,
+        f'products:category:{category_id}': sign,
+        'stock': sign * stock,
+        f'stock:category:{category_id}': sign * stock,
+    }
+
+
+def review_deltas(rating, sign=1):
+    return {'reviews': sign, 'reviews:rating_sum': sign * rating}
+
+
+def combine(*deltas):
+    total = Counter()
+    for delta in deltas:
+        total.update(delta)
+    return dict(total)
+
+
+def record(*deltas):
+    """Apply deltas to the counters within the current transaction"""
+    StatCounter.adjust(combine(*deltas))
+
+
+def compute_counters():
+    """Counter values from full scans of the underlying tables"""
+    counters = Counter()
+    for role, count in db.session.query(User.role, db.func.count(User.id)).group_by(User.role):
+        counters.update(user_deltas(role, count))
+    for category_id, count, stock in db.session.query(
+        Product.category_id, db.func.count(Product.id), db.func.coalesce(db.func.sum(Product.stock_quantity), 0)
+    ).group_by(Product.category_id):
+        counters.update({
+            'products': count,
+            f'products:category:{category_id}': count,
+            'stock': stock,
+            f'stock:category:{category_id}': stock,
+        })
+    count, rating_sum = db.session.query(
+        db.func.count(Review.id), db.func.coalesce(db.func.sum(Review.rating), 0)
+    ).one()
+    counters.update({'reviews': count, 'reviews:rating_sum': rating_sum})
+    return counters
+
+
+def rebuild():
+    """Replace every counter with freshly computed values in one transaction"""
+    counters = compute_counters()
+    StatCounter.query.delete(synchronize_session=False)
+    if counters:
+        db.session.execute(db.insert(StatCounter), [
+            {'key': key, 'value': int(value)} for key, value in counters.items()
+        ])
+    db.session.commit()
+    return len(counters)
+
+
+def snapshot():
+    """The dashboard statistics, read from the counter rows only"""
+    counters = {key: value for key, value in db.session.query(StatCounter.key, StatCounter.value)}
+    titles = dict(db.session.query(Category.id, Category.title))
+
+    by_role = {}
+    by_category = {}
+    for key, value in counters.items():
+        kind, _, rest = key.partition(':')
+        if kind == 'users' and rest.startswith('role:'):
+            by_role[rest[len('role:'):]] = value
+        elif kind in ('products', 'stock') and rest.startswith('category:'):
+            category_id = rest[len('category:'):]
+            entry = by_category.setdefault(category_id, {
+                'title': titles.get(int(category_id)) if category_id.isdigit() else None,
+                'products': 0,
+                'stock': 0,
+            })
+            entry[kind] = value
+
+    reviews = counters.get('reviews', 0)
+    return {
+        'users': {'total': counters.get('users', 0), 'by_role': by_role},
+        'products': {
+            'total': counters.get('products', 0),
+            'stock_total': counters.get('stock', 0),
+            'by_category': by_category,
+        },
+        'reviews': {
+            'total': reviews,
+            'average_rating': counters.get('reviews:rating_sum', 0) / reviews if reviews else 0.0,
+        },
+    }
@@ -0,0 +1,118 @@
+import os
+import time
+from app import db
+from app.models import Product, ImageBlob
+from app.utils.image_pipeline import original_path
+
+# Folders under UPLOADS_FOLDER that FileHandler writes to; anything else is left alone
+UPLOAD_SUBFOLDERS = ('products',)
+
+
+def prune_empty_dirs(upload_folder, relative_path):
+    """Remove the directories above a deleted file that it left empty, up to its subfolder"""
+    relative_dir = os.path.dirname(relative_path)
+    while os.path.dirname(relative_dir):
+        try:
+            os.rmdir(os.path.join(upload_folder, relative_dir))
+        except OSError:
+            # Not empty, or already gone
+            return
+        relative_dir = os.path.dirname(relative_dir)
+
+
+def referenced_paths(yield_per=1000):
+    """Every upload path some product or image blob row still points at"""
+    referenced = set()
+    for (images,) in db.session.query(Product.images).execution_options(yield_per=yield_per):
+        referenced.update(images or [])
+    for (path,) in db.session.query(ImageBlob.path).filter(ImageBlob.ref_count > 0).execution_options(yield_per=yield_per):
+        referenced.add(path)
+    return referenced
+
+
+def walk_uploads(upload_folder, subfolders=UPLOAD_SUBFOLDERS):
+    """Yield (relative path, DirEntry) for every file under the upload subfolders"""
+    stack = list(subfolders)
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(upload_folder, relative_dir))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                relative_path = f'{relative_dir}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(relative_path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield relative_path, entry
+
+
+class UploadCollector:
+    """Deletes uploads that no product references anymore.
+
+    Only the subfolders FileHandler writes to are scanned. Files younger
+    than `grace_period` seconds are kept, which covers uploads whose product
+    hasn't been committed yet and deduplicated uploads (saving one rewrites
+    the blob and refreshes its mtime). Variants live as long as their
+    original is referenced. Deletions happen in batches of `batch_size`, each
+    re-checked against image_blob first, and directories they leave empty
+    are removed. A run stops after `limit` deletions so large backlogs can be
+    worked off incrementally.
+    """
+
+    def __init__(self, upload_folder, grace_period=86400, batch_size=500, limit=None, dry_run=False):
+        self.upload_folder = upload_folder
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.limit = limit
+        self.dry_run = dry_run
+        self.stats = {'scanned': 0, 'referenced': 0, 'recent': 0, 'deleted': 0, 'bytes': 0}
+
+    def is_referenced(self, path, referenced):
+        return path in referenced or original_path(path) in referenced
+
+    def run(self, on_delete=None):
+        referenced = referenced_paths()
+        cutoff = time.time() - self.grace_period
+        batch = []
+        for path, entry in walk_uploads(self.upload_folder):
+            self.stats['scanned'] += 1
+            if self.is_referenced(path, referenced):
+                self.stats['referenced'] += 1
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                self.stats['recent'] += 1
+                continue
+            batch.append((path, stat.st_size))
+            if len(batch) >= self.batch_size:
+                self.delete_batch(batch, on_delete)
+                batch = []
+            if self.limit is not None and self.stats['deleted'] + len(batch) >= self.limit:
+                break
+        if batch:
+            self.delete_batch(batch, on_delete)
+        return self.stats
+
+    def delete_batch(self, batch, on_delete=None):
+        # Locks each blob's row like discard_images, so blobs retained after
+        # the reference snapshot was taken, or being stored again, are kept
+        freed = set(ImageBlob.claim_unreferenced(original_path(path) or path for path, _ in batch))
+        for path, size in batch:
+            if (original_path(path) or path) not in freed:
+                continue
+            if not self.dry_run:
+                try:
+                    os.remove(os.path.join(self.upload_folder, path))
+                except FileNotFoundError:
+                    continue
+                prune_empty_dirs(self.upload_folder, path)
+            self.stats['deleted'] += 1
+            self.stats['bytes'] += size
+            if on_delete:
+                on_delete(path)
+        if self.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
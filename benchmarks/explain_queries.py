@@ -0,0 +1,79 @@
+"""Print the query plan for every product listing and review query shape.
+
+Usage:
+    python benchmarks/explain_queries.py [DATABASE_URI]
+
+Defaults to an in-memory SQLite database with the schema created from the
+models. Against Postgres, point it at a migrated database (ideally one with
+realistic data and fresh ANALYZE statistics) to confirm the indexes are used.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+if len(sys.argv) > 1:
+    os.environ['SQLALCHEMY_DATABASE_URI'] = sys.argv[1]
+os.environ.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+from app import create_app, db
+from app.models import Product, Review
+from app.routes.product_routes import (
+    PRODUCT_ORDERINGS, filter_products, order_products, product_list_query, seek_products
+)
+from app.serializers import PRODUCT_LIST_FIELDS
+
+# The default listing joins category and user for their names, a sparse card doesn't join at all
+FIELDSETS = {
+    'list fields': PRODUCT_LIST_FIELDS,
+    'card fields': ('id', 'title', 'price', 'image_variants'),
+}
+
+FILTERS = {
+    'no filter': {},
+    'category': {'category_id': 1},
+    'category + price': {'category_id': 1, 'price_range': '10,50'},
+    'category + rating': {'category_id': 1, 'rating_range': '3,5'},
+    'price': {'price_range': '10,50'},
+    'rating': {'rating_range': '3,5'},
+}
+
+
+def explain(query):
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(db.text(prefix + sql)).all()
+    # SQLite returns (id, parent, notused, detail), Postgres a single column
+    return [row[-1] for row in rows]
+
+
+def listing_shapes():
+    """The queries list_products runs: the page itself and, for offset pages, the total count"""
+    for filter_name, filters in FILTERS.items():
+        count_query = filter_products(db.session.query(Product.id), **filters)
+        yield f'{filter_name}, count', db.session.query(db.func.count()).select_from(count_query.subquery())
+        for fields_name, fields in FIELDSETS.items():
+            for order_by in PRODUCT_ORDERINGS:
+                query = filter_products(product_list_query(fields, order_by), **filters)
+                query = order_products(query, order_by)
+                name = f'{filter_name}, {fields_name}, {order_by}'
+                yield f'{name}, offset', query.limit(20).offset(200)
+                yield f'{name}, cursor', seek_products(query, order_by, 10, 500).limit(21)
+
+
+def review_shapes():
+    query = Review.query.filter_by(product_id=1).order_by(Review.created_at.desc(), Review.id.desc())
+    yield 'reviews by product', query.limit(5).offset(10)
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            db.create_all()
+        for name, query in [*listing_shapes(), *review_shapes()]:
+            print(f'== {name}')
+            for line in explain(query):
+                print(f'   {line}')
@@ -0,0 +1,137 @@
+"""Compare facet counts from one grouped query against one COUNT per facet value.
+
+Usage:
+    python benchmarks/facets_benchmark.py [--rows 1000000] [--database URI]
+
+Seeds the database with generated products spread over several categories
+on first run (an SQLite file by default, reused on later runs), then times
+category/price/rating facets for a few filter sets: the grouped query used
+by GET /api/products?facets=, the same request served from the cache, and
+the per-facet-value COUNT queries the sidebar needed before.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+CATEGORIES = 20
+FILTERS = [
+    {},
+    {'category_id': 3},
+    {'price_range': '10,100'},
+    {'category_id': 7, 'rating_range': '3,5'},
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--database', default='sqlite:////tmp/georgehub_facets_benchmark.db')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+def seed(db, Product, Category, User, rows):
+    existing = db.session.query(db.func.count(Product.id)).scalar()
+    if existing >= rows:
+        return
+    if not db.session.get(Category, 1):
+        for n in range(1, CATEGORIES + 1):
+            db.session.add(Category(id=n, title=f'Category {n}'))
+        db.session.add(User(email='bench@example.com', username='bench', password='-', role='seller'))
+        db.session.commit()
+    user_id = db.session.query(User.id).filter_by(username='bench').scalar()
+    rng = random.Random(existing)
+    batch = []
+    for n in range(existing, rows):
+        batch.append({
+            'title': f'Product {n}',
+            'description': '',
+            'images': [],
+            'price': round(rng.lognormvariate(3.5, 1.2), 2),
+            'stock_quantity': 1,
+            'overall_rating': round(rng.uniform(0, 5), 1),
+            'category_id': rng.randint(1, CATEGORIES),
+            'user_id': user_id,
+        })
+        if len(batch) == 10000:
+            db.session.execute(db.insert(Product), batch)
+            db.session.commit()
+            batch = []
+            print(f'\rseeded {n + 1}/{rows}', end='', flush=True)
+    if batch:
+        db.session.execute(db.insert(Product), batch)
+        db.session.commit()
+    print()
+
+
+def timed(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    args = parse_args()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.database
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from app import create_app, db
+    from app.models import Product, Category, User
+    from app.routes.product_routes import filter_products, normalize_range
+    from app.utils.cache import catalog_cache
+    from app.utils.facets import count_facets, FACETS, PRICE_BUCKETS, RATING_BUCKETS
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(db, Product, Category, User, args.rows)
+        client = app.test_client()
+
+        def base_query(filters):
+            return filter_products(
+                Product.query,
+                filters.get('category_id'),
+                filters.get('price_range'),
+                filters.get('rating_range'),
+            )
+
+        def grouped(filters):
+            count_facets(base_query(filters), list(FACETS))
+
+        def per_value(filters):
+            query = base_query(filters)
+            for category_id in range(1, CATEGORIES + 1):
+                query.filter(Product.category_id == category_id).count()
+            for column, bounds in ((Product.price, PRICE_BUCKETS), (Product.overall_rating, RATING_BUCKETS)):
+                for index, lower in enumerate(bounds):
+                    bucket = query.filter(column >= lower)
+                    if index + 1 < len(bounds):
+                        bucket = bucket.filter(column < bounds[index + 1])
+                    bucket.count()
+
+        def cached(filters):
+            params = {key: normalize_range(value) if key.endswith('range') else value for key, value in filters.items()}
+            response = client.get('/api/products', query_string={**params, 'facets': ','.join(FACETS)})
+            assert response.status_code == 200, response.data
+
+        print(f'{"filters":<40}{"grouped ms":>12}{"cached ms":>12}{"per value ms":>14}')
+        for filters in FILTERS:
+            catalog_cache.bump()
+            cached(filters)
+            label = ', '.join(f'{key}={value}' for key, value in filters.items()) or 'none'
+            print(f'{label:<40}'
+                  f'{timed(lambda: grouped(filters), args.repeat):>12.1f}'
+                  f'{timed(lambda: cached(filters), args.repeat):>12.1f}'
+                  f'{timed(lambda: per_value(filters), args.repeat):>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
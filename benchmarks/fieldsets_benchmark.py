@@ -0,0 +1,90 @@
+"""Measure what sparse fieldsets save per product listing page.
+
+Usage:
+    python benchmarks/fieldsets_benchmark.py [--rows 20000] [--per-page 20]
+
+Seeds a throwaway SQLite database with products carrying realistic
+descriptions and image lists, then requests GET /api/products with all
+fields and with a card-sized fields= set. Reports columns selected, bytes
+read from the database, response bytes and time per page.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+FIELDSETS = {
+    'all fields': None,
+    'card': 'id,title,price,overall_rating,image_variants',
+    'card + names': 'id,title,price,overall_rating,image_variants,category_name,seller_name',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    database = os.path.join(tempfile.mkdtemp(), 'fieldsets_benchmark.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    os.environ['CATALOG_CACHE_SIZE'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from app import create_app, db
+    from app.models import Product, Category, User
+    from app.routes.product_routes import parse_fields, product_list_query
+    from app.utils.cache import catalog_cache
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(Category(id=1, title='Benchmark'))
+        db.session.add(User(email='bench@example.com', username='bench', password='-', role='seller'))
+        db.session.commit()
+        rng = random.Random(1)
+        words = 'soft cotton wireless leather sturdy compact modern classic premium handmade'.split()
+        db.session.execute(db.insert(Product), [{
+            'title': ' '.join(rng.choices(words, k=5)),
+            'description': ' '.join(rng.choices(words, k=150)),
+            'images': [f'products/{n}_{i}.jpg' for i in range(4)],
+            'price': rng.randint(100, 100000) / 100,
+            'stock_quantity': 1,
+            'category_id': 1,
+            'user_id': 1,
+        } for n in range(args.rows)])
+        db.session.commit()
+
+        client = app.test_client()
+        print(f'{args.rows} products, {args.per_page} per page')
+        print(f'{"fields":<15}{"columns":>9}{"db bytes":>10}{"response bytes":>16}{"ms per page":>13}')
+        for label, fields in FIELDSETS.items():
+            query = product_list_query(parse_fields(fields), 'created_at')
+            rows = query.order_by(Product.created_at.desc()).limit(args.per_page).all()
+            db_bytes = sum(len(str(value)) for row in rows for value in row if value is not None)
+
+            params = {'per_page': args.per_page}
+            if fields:
+                params['fields'] = fields
+            samples = []
+            for n in range(args.repeat):
+                catalog_cache.bump()
+                started = time.perf_counter()
+                response = client.get('/api/products', query_string={**params, 'page': n % 10 + 1})
+                samples.append((time.perf_counter() - started) * 1000)
+            print(f'{label:<15}{len(query.statement.selected_columns):>9}{db_bytes:>10}'
+                  f'{len(response.get_data()):>16}{statistics.median(samples):>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare bytes served for a listing page with original images vs. variants.
+
+Usage:
+    python benchmarks/image_bytes_benchmark.py [--images 20] [--size 2400] [--format webp]
+
+Generates synthetic photo-like PNGs in a temporary uploads folder, runs the
+image pipeline over them and reports the total bytes a product listing page
+would download with originals, card variants and thumbnails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--size', type=int, default=2400, help='Longest side of the generated originals')
+    parser.add_argument('--format', default='webp', choices=['webp', 'jpeg'])
+    parser.add_argument('--workers', type=int, default=2)
+    return parser.parse_args()
+
+
+def make_image(path, size):
+    from PIL import Image, ImageDraw, ImageFilter
+
+    image = Image.new('RGB', (size, size * 3 // 4), tuple(random.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = random.randrange(image.width), random.randrange(image.height)
+        r = random.randrange(20, size // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(random.randrange(256) for _ in range(3)))
+    image.filter(ImageFilter.GaussianBlur(4)).save(path, 'PNG')
+
+
+def main():
+    args = parse_args()
+    from app.utils.image_pipeline import ImagePipeline, VARIANTS
+
+    upload_folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(upload_folder, 'products'))
+    paths = []
+    for i in range(args.images):
+        path = f'products/bench_{i}.png'
+        make_image(os.path.join(upload_folder, path), args.size)
+        paths.append(path)
+
+    pipeline = ImagePipeline(upload_folder, fmt=args.format, workers=args.workers)
+    started = time.perf_counter()
+    for path, result in pipeline.map(paths):
+        if isinstance(result, Exception):
+            raise result
+    elapsed = time.perf_counter() - started
+
+    def total(files):
+        return sum(os.path.getsize(os.path.join(upload_folder, f)) for f in files)
+
+    originals = total(paths)
+    print(f'{args.images} images, {args.size}px originals, {args.format}, {args.workers} workers')
+    print(f'generated in {elapsed:.2f}s ({elapsed / args.images * 1000:.0f} ms per image)')
+    print(f'{"original":>10}: {originals / 1024:10.1f} KiB')
+    for variant in VARIANTS:
+        size = total(pipeline.variants(path)[variant] for path in paths)
+        print(f'{variant:>10}: {size / 1024:10.1f} KiB ({size / originals:.1%} of originals)')
+
+
+if __name__ == '__main__':
+    main()
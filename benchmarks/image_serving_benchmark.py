@@ -0,0 +1,65 @@
+"""Measure how long a worker is occupied serving images, with and without proxy offload.
+
+Usage:
+    python benchmarks/image_serving_benchmark.py [--requests 200] [--size-kb 512]
+
+Requests the same uploads through GET /api/uploads/<path> with IMAGE_SERVING
+set to direct, x-sendfile and x-accel. In direct mode the worker reads and
+sends every byte; with offload it only returns headers and the proxy sends
+the file. Conditional (If-None-Match) requests are measured as well.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--size-kb', type=int, default=512)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    upload_folder = tempfile.mkdtemp()
+    os.environ['UPLOADS_FOLDER'] = upload_folder
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from app import create_app
+
+    path = 'products/' + 'ab' * 32 + '.png'
+    os.makedirs(os.path.join(upload_folder, 'products'))
+    with open(os.path.join(upload_folder, path), 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + os.urandom(args.size_kb * 1024))
+
+    app = create_app()
+    print(f'{args.requests} requests for a {args.size_kb} KiB image')
+    for mode in ('direct', 'x-sendfile', 'x-accel'):
+        app.config['IMAGE_SERVING'] = mode
+        app.config['USE_X_SENDFILE'] = mode == 'x-sendfile'
+        client = app.test_client()
+        etag = client.get(f'/api/uploads/{path}').headers.get('ETag')
+
+        for label, headers in (('full', {}), ('conditional', {'If-None-Match': etag} if etag else None)):
+            if headers is None:
+                continue
+            body_bytes = 0
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                response = client.get(f'/api/uploads/{path}', headers=headers)
+                # Reading the body is the part of the work the worker does itself
+                body_bytes += len(response.get_data())
+            elapsed = time.perf_counter() - started
+            print(f'{mode:>10} {label:>11}: {elapsed / args.requests * 1000:7.3f} ms per request, '
+                  f'{body_bytes / args.requests / 1024:8.1f} KiB through the worker, status {response.status_code}')
+
+
+if __name__ == '__main__':
+    main()
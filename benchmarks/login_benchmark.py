@@ -0,0 +1,59 @@
+"""Measure login throughput of a single worker process.
+
+Usage:
+    python benchmarks/login_benchmark.py [--threads 4] [--logins 40] [--method pbkdf2:sha256]
+
+Runs concurrent POST /auth/login requests through the test client against a
+throwaway SQLite database. Threads stand in for a threaded gunicorn worker;
+compare runs with different PASSWORD_HASH_WORKERS values and hash methods.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--method', default='pbkdf2:sha256')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    database = os.path.join(tempfile.mkdtemp(), 'login_benchmark.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    os.environ['PASSWORD_HASH_METHOD'] = args.method
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from app import create_app, db, credentials
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email='bench@example.com', username='bench', password=credentials.hash('secret'), role='buyer'))
+        db.session.commit()
+
+    def login(_):
+        client = app.test_client()
+        response = client.post('/auth/login', json={'username': 'bench', 'password': 'secret'})
+        assert response.status_code == 200, response.data
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - started
+    print(f'{args.logins} logins, {args.threads} threads, {credentials.max_workers} hash workers, {args.method}')
+    print(f'{args.logins / elapsed:.1f} logins/s, {elapsed / args.logins * 1000:.1f} ms per login')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Compare full-text search against naive ILIKE matching on a large catalog.
+
+Usage:
+    python benchmarks/search_benchmark.py [--rows 1000000] [--database URI]
+
+Seeds the database with generated products on first run (an SQLite file by
+default, reused on later runs), then times a first page plus total count
+for several queries with both strategies.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+WORDS = (
+    'apple banana cherry wooden metal leather cotton wireless charger laptop '
+    'phone case lamp chair table desk shelf mug bottle kettle blender camera '
+    'lens tripod guitar piano drum novel poster frame rug pillow blanket '
+    'jacket boots scarf gloves watch bracelet ring necklace backpack wallet'
+).split()
+QUERIES = ['apple', 'wireless charger', 'leather boots', 'piano', 'ceramic']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--database', default='sqlite:////tmp/georgehub_search_benchmark.db')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+def seed(db, Product, Category, User, rows):
+    existing = db.session.query(db.func.count(Product.id)).scalar()
+    if existing >= rows:
+        return
+    if not db.session.get(Category, 1):
+        db.session.add(Category(id=1, title='Benchmark'))
+        db.session.add(User(email='bench@example.com', username='bench', password='-', role='seller'))
+        db.session.commit()
+    user_id = db.session.query(User.id).filter_by(username='bench').scalar()
+    rng = random.Random(existing)
+    batch = []
+    for n in range(existing, rows):
+        batch.append({
+            'title': ' '.join(rng.choices(WORDS, k=4)),
+            'description': ' '.join(rng.choices(WORDS, k=30)),
+            'images': [],
+            'price': rng.randint(100, 100000) / 100,
+            'stock_quantity': 1,
+            'category_id': 1,
+            'user_id': user_id,
+        })
+        if len(batch) == 10000:
+            db.session.execute(db.insert(Product), batch)
+            db.session.commit()
+            batch = []
+            print(f'\rseeded {n + 1}/{rows}', end='', flush=True)
+    if batch:
+        db.session.execute(db.insert(Product), batch)
+        db.session.commit()
+    print()
+
+
+def timed(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    args = parse_args()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.database
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from app import create_app, db
+    from app.models import Product, Category, User
+    from app.utils.search import search_products
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(db, Product, Category, User, args.rows)
+
+        def full_text(q):
+            query, relevance = search_products(Product.query, q)
+            query.order_by(relevance, Product.id.desc()).limit(20).all()
+            query.order_by(None).count()
+
+        def ilike(q):
+            query = Product.query
+            for term in q.split():
+                pattern = f'%{term}%'
+                query = query.filter(db.or_(Product.title.ilike(pattern), Product.description.ilike(pattern)))
+            query.order_by(Product.created_at.desc(), Product.id.desc()).limit(20).all()
+            query.order_by(None).count()
+
+        print(f'{"query":<20}{"full-text ms":>15}{"ILIKE ms":>15}')
+        for q in QUERIES:
+            print(f'{q:<20}{timed(lambda: full_text(q), args.repeat):>15.1f}{timed(lambda: ilike(q), args.repeat):>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Measure CPU spent per 100-item product listing page before and after the row serializers.
+
+Usage:
+    python benchmarks/serialization_benchmark.py [--rows 5000] [--per-page 100]
+
+Seeds a throwaway SQLite database, then builds the same listing page three
+ways: hydrated ORM objects with hand-built dicts and stdlib json (how the
+routes used to do it), the row serializer with stdlib json, and the
+row serializer with the orjson provider. Also times full GET /api/products
+requests with the stdlib and orjson providers. Reports the best process CPU
+time per page over the repeats, so waiting on the database doesn't count.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    return parser.parse_args()
+
+
+def cpu_ms(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        run()
+        samples.append((time.process_time() - started) * 1000)
+    return min(samples)
+
+
+def main():
+    args = parse_args()
+    database = os.path.join(tempfile.mkdtemp(), 'serialization_benchmark.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    os.environ['CATALOG_CACHE_SIZE'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('ALLOWED_ORIGIN', 'http://localhost')
+
+    from flask.json.provider import DefaultJSONProvider
+    from app import create_app, db
+    from app.models import Product, Category, User
+    from app.serializers import product_serializer, PRODUCT_LIST_FIELDS
+    from app.utils.image_pipeline import image_pipeline
+    from app.utils.json_provider import ORJSONProvider, orjson
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(Category(id=1, title='Benchmark'))
+        db.session.add(User(email='bench@example.com', username='bench', password='-', role='seller'))
+        db.session.commit()
+        rng = random.Random(1)
+        words = 'soft cotton wireless leather sturdy compact modern classic premium handmade'.split()
+        db.session.execute(db.insert(Product), [{
+            'title': ' '.join(rng.choices(words, k=5)),
+            'description': ' '.join(rng.choices(words, k=40)),
+            'images': [f'products/{n}_{i}.jpg' for i in range(3)],
+            'price': rng.randint(100, 100000) / 100,
+            'stock_quantity': 1,
+            'category_id': 1,
+            'user_id': 1,
+        } for n in range(args.rows)])
+        db.session.commit()
+
+        def orm_dicts():
+            products = Product.query.options(
+                db.joinedload(Product.category),
+                db.joinedload(Product.user)
+            ).order_by(Product.created_at.desc()).limit(args.per_page).all()
+            items = [{
+                'id': p.id,
+                'title': p.title,
+                'description': p.description,
+                'price': p.price,
+                'stock_quantity': p.stock_quantity,
+                'images': p.images,
+                'image_variants': image_pipeline.variants_for(p.images),
+                'overall_rating': p.overall_rating,
+                'review_count': p.rating_count,
+                'category_id': p.category_id,
+                'category_name': p.category.title,
+                'seller_name': p.user.username
+            } for p in products]
+            db.session.expunge_all()
+            return items
+
+        def rows():
+            serialize = product_serializer.compile(PRODUCT_LIST_FIELDS, extra=(Product.created_at,))
+            query = product_serializer.query(PRODUCT_LIST_FIELDS, extra=(Product.created_at,))
+            return [serialize(row) for row in query.order_by(Product.created_at.desc()).limit(args.per_page)]
+
+        stdlib = DefaultJSONProvider(app)
+        fast = ORJSONProvider(app) if orjson is not None else None
+        cases = {
+            'ORM + dicts + json': lambda: stdlib.dumps({'items': orm_dicts()}),
+            'rows + json': lambda: stdlib.dumps({'items': rows()}),
+        }
+        if fast:
+            cases['rows + orjson'] = lambda: fast.dumps({'items': rows()})
+
+        print(f'{args.rows} products, {args.per_page} per page, CPU ms per page')
+        print(f'{"build + encode":<22}{"cpu ms":>10}')
+        for label, run in cases.items():
+            run()
+            print(f'{label:<22}{cpu_ms(run, args.repeat):>10.2f}')
+
+        client = app.test_client()
+        print(f'\n{"GET /api/products":<22}{"cpu ms":>10}')
+        for label, provider in (('stdlib json', stdlib), ('orjson', fast)):
+            if provider is None:
+                continue
+            app.json = provider
+            run = lambda: client.get('/api/products', query_string={'per_page': args.per_page})
+            assert run().status_code == 200
+            print(f'{label:<22}{cpu_ms(run, args.repeat):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,14 @@
   flask db migrate
   flask db upgrade
 
+  # Create the full-text search column and index (idempotent)
+  flask install-search-index
+
+  # Recompute the admin dashboard counters from the tables
+  flask rebuild-stats
+
+  # Start the new workers' metrics from zero
+  if [ -n "$METRICS_DIR" ]; then rm -rf "$METRICS_DIR"; fi
+
   # Start the Gunicorn server
   gunicorn run:app
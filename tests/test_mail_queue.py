@@ -0,0 +1,164 @@
+import socketserver
+import threading
+import time
+
+import pytest
+from flask import Flask
+from flask_mail import Mail, Message
+
+from app.utils.mail_queue import MailQueue
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts every message and records it"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250 stub')
+            elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line)
+                server.release.wait()
+                time.sleep(server.delay)
+                with server.lock:
+                    if server.fail_next:
+                        server.fail_next -= 1
+                        self.reply('451 Try again later')
+                        continue
+                    server.messages.append(b''.join(data))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        # Rejected DATA commands still to come, and how long each one takes
+        self.fail_next = 0
+        self.delay = 0.0
+        # Cleared to hold every DATA command until it is set again
+        self.release = threading.Event()
+        self.release.set()
+
+
+@pytest.fixture
+def smtp_server():
+    server = StubSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def make_queue(server, **kwargs):
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=server.server_address[1],
+        MAIL_USE_SSL=False,
+        MAIL_USE_TLS=False,
+        MAIL_DEFAULT_SENDER='shop@example.com',
+        MAIL_QUEUE_WORKERS=kwargs.pop('workers', 1),
+    )
+    mail = Mail(app)
+    mail_queue = MailQueue(mail, **kwargs)
+    mail_queue.init_app(app)
+    return mail_queue
+
+
+def message(n=0):
+    # Built outside an app context, so the default sender can't be looked up
+    return Message(
+        f'Code {n}', sender='shop@example.com', recipients=[f'buyer{n}@example.com'], body=f'Your code: {n}'
+    )
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for the mail queue')
+        time.sleep(0.01)
+
+
+def test_delivers_over_one_reused_connection(smtp_server):
+    mail_queue = make_queue(smtp_server)
+    for n in range(5):
+        mail_queue.send(message(n))
+    wait_for(lambda: mail_queue.stats()['sent'] == 5)
+
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+
+
+def test_failed_send_is_retried_after_backoff(smtp_server):
+    smtp_server.fail_next = 1
+    mail_queue = make_queue(smtp_server, backoff=0.2)
+    started = time.monotonic()
+    mail_queue.send(message())
+    wait_for(lambda: mail_queue.stats()['sent'] == 1)
+
+    assert time.monotonic() - started >= 0.2
+    assert len(smtp_server.messages) == 1
+    # The failed connection is dropped and the retry opens a fresh one
+    assert smtp_server.connections == 2
+    stats = mail_queue.stats()
+    assert stats['retried'] == 1
+    assert stats['failed'] == 0
+
+
+def test_gives_up_after_max_retries(smtp_server):
+    smtp_server.fail_next = 3
+    mail_queue = make_queue(smtp_server, max_retries=2, backoff=0.01)
+    mail_queue.send(message())
+    wait_for(lambda: mail_queue.stats()['failed'] == 1)
+
+    assert mail_queue.stats()['retried'] == 2
+    assert smtp_server.messages == []
+
+
+def test_stats_report_queue_depth_and_send_latency(smtp_server):
+    smtp_server.delay = 0.05
+    smtp_server.release.clear()
+    mail_queue = make_queue(smtp_server, batch_size=1)
+    for n in range(4):
+        mail_queue.send(message(n))
+    # The worker holds the first message, waiting on the server
+    wait_for(lambda: mail_queue.stats()['queue_depth'] == 3)
+
+    smtp_server.release.set()
+    wait_for(lambda: mail_queue.stats()['sent'] == 4)
+    stats = mail_queue.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['send_seconds_avg'] >= 0.05
+    assert stats['send_seconds_max'] >= stats['send_seconds_avg']